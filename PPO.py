@@ -1,42 +1,89 @@
 import os
+from functools import partial
 from stable_baselines3 import PPO
 from stable_baselines3.common.env_checker import check_env
 from stable_baselines3.common.callbacks import BaseCallback
-import matplotlib.pyplot as plt
 
 from game_env import MyGameEnv
+from vec_game_env import MyGameVecEnv
+from env_pool import SharedMemoryVecEnv
+from dataset import TrajectoryDataset
 import torch as th
 
 import warnings
 
 
-def train_PPO(policy='MlpPolicy', model_name='ppo_pixel_obs', ent_coeff=0.0, learning_rate=0.003, clip_range=0.2):
+def make_env(reward_function=None, headless=True, n_workers=1, envs_per_worker=1, obs_type='state'):
+    """A single MyGameEnv, or n_workers processes of headless MyGameEnvs behind a SharedMemoryVecEnv."""
+    if n_workers <= 1:
+        return MyGameEnv(reward_function=reward_function, headless=headless, obs_type=obs_type)
+
+    env_fn = partial(MyGameEnv, reward_function=reward_function, headless=True, obs_type=obs_type)
+    return SharedMemoryVecEnv(env_fn, n_envs=n_workers * envs_per_worker, n_workers=n_workers)
+
+
+def pretrain_behavior_cloning(model, dataset_dir, epochs=1, batch_size=256, learning_rate=0.001):
+    """Behavior-clone recorded demonstrations (a dataset.TrajectoryWriter directory) into a PPO model's policy, by
+    maximising the likelihood of each demonstrated action given its observation - one pass over the data per
+    epoch, streamed in shuffled minibatches."""
+    dataset = TrajectoryDataset(dataset_dir, columns=('obs', 'action'))
+    if dataset.shape('obs') != model.observation_space.shape:
+        raise ValueError(f"Demonstrations have observations of shape {dataset.shape('obs')}, the model expects "
+                         f"{model.observation_space.shape}")
+
+    policy = model.policy
+    policy.set_training_mode(True)
+    optimizer = th.optim.Adam(policy.parameters(), lr=learning_rate)
+    for epoch in range(epochs):
+        total_loss, batches = 0.0, 0
+        for batch in dataset.minibatches(batch_size):
+            obs = th.as_tensor(batch['obs'], device=model.device)
+            actions = th.as_tensor(batch['action'], device=model.device)
+            _, log_prob, _ = policy.evaluate_actions(obs, actions)
+            loss = -log_prob.mean()
+
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item()
+            batches += 1
+        print(f'Behavior cloning epoch {epoch + 1}/{epochs}: {len(dataset)} ticks, loss {total_loss / max(batches, 1):.4f}')
+
+
+def train_PPO(policy='MlpPolicy', model_name='ppo_pixel_obs', ent_coeff=0.0, learning_rate=0.003, clip_range=0.2, headless=True, n_workers=1, obs_type='state', demonstrations=None, bc_epochs=1):
     # Device
     device = th.device("cuda" if th.cuda.is_available() else "cpu")
 
     # Suppress warnings
     warnings.filterwarnings("ignore")
 
-    # Initialize your custom environment
-    env = MyGameEnv()
+    # Initialize your custom environment (use policy='CnnPolicy' with obs_type='pixels')
+    env = make_env(headless=headless, n_workers=n_workers, obs_type=obs_type)
 
     # Check the environment to make sure it's correctly implemented
-    check_env(env)
+    if n_workers <= 1:
+        check_env(env)
 
     # Create the RL agent
     model = PPO(policy, env, verbose=1, device=device, ent_coef=ent_coeff, learning_rate=learning_rate, clip_range=clip_range)
 
+    # Start from recorded human play if there is any (state observations only)
+    if demonstrations:
+        pretrain_behavior_cloning(model, demonstrations, epochs=bc_epochs)
+
     # Train the agent
     model.learn(total_timesteps=1000000)
 
     # Save the model
     model.save(model_name)
 
+    env.close()
+
 
-def train_ppo_v2(policy='MlpPolicy', model_name='ppo_bullet_avoidance_reward_v2', ent_coeff=0.0, learning_rate=0.003, clip_range=0.2, reward_function=MyGameEnv._calculate_reward):
+def train_ppo_v2(policy='MlpPolicy', model_name='ppo_bullet_avoidance_reward_v2', ent_coeff=0.0, learning_rate=0.003, clip_range=0.2, reward_function=MyGameEnv._calculate_reward, headless=True, n_workers=1):
     device = th.device("cuda" if th.cuda.is_available() else "cpu")
 
-    env = MyGameEnv(reward_function=reward_function)
+    env = make_env(reward_function=reward_function, headless=headless, n_workers=n_workers)
 
     model = PPO(policy, env, verbose=1, device=device, ent_coef=ent_coeff, learning_rate=learning_rate, clip_range=clip_range)
 
@@ -46,12 +93,27 @@ def train_ppo_v2(policy='MlpPolicy', model_name='ppo_bullet_avoidance_reward_v2'
 
     model.save(model_name)
 
+    env.close()
+
     performance_logger.save_results(reward_filename=f'plots/{model_name}_rewards.png', length_filename=f'plots/{model_name}_lengths.png')
 
 
-def retrain_PPO(model_name='game-state-obs-001-0007-03', ent_coeff=0.0, learning_rate=0.003, clip_range=0.2):
+def train_ppo_batched(policy='MlpPolicy', model_name='ppo_batched', ent_coeff=0.0, learning_rate=0.003, clip_range=0.2, reward_function=MyGameEnv._calculate_reward, n_envs=256, total_timesteps=1000000):
+    """Train on n_envs games simulated in lockstep by the NumPy engine (see vec_game.VecGame)."""
+    device = th.device("cuda" if th.cuda.is_available() else "cpu")
+
+    env = MyGameVecEnv(n_envs, reward_function=reward_function)
+
+    model = PPO(policy, env, verbose=1, device=device, ent_coef=ent_coeff, learning_rate=learning_rate, clip_range=clip_range)
 
-    env = MyGameEnv()
+    model.learn(total_timesteps=total_timesteps)
+
+    model.save(model_name)
+
+
+def retrain_PPO(model_name='game-state-obs-001-0007-03', ent_coeff=0.0, learning_rate=0.003, clip_range=0.2, headless=True, n_workers=1):
+
+    env = make_env(headless=headless, n_workers=n_workers)
 
     model = PPO.load(model_name, env=env)
 
@@ -59,6 +121,8 @@ def retrain_PPO(model_name='game-state-obs-001-0007-03', ent_coeff=0.0, learning
 
     model.save("game-state-obs-001-0007-03-retrained")
 
+    env.close()
+
 
 class PerformanceLoggerCallback(BaseCallback):
     def __init__(self, trial_number, params, save_dir='plots', verbose=0):
@@ -89,6 +153,8 @@ class PerformanceLoggerCallback(BaseCallback):
         return True
 
     def plot_results(self):
+        import matplotlib.pyplot as plt  # only needed for plotting, so not imported with the module
+
         # Plot rewards
         plt.figure(figsize=(12, 5))
         plt.plot(self.episode_rewards, label='Episode Reward')
@@ -109,6 +175,8 @@ class PerformanceLoggerCallback(BaseCallback):
 
     def save_results(self):
         """Save the performance plots as PNG files."""
+        import matplotlib.pyplot as plt
+
         # Plot rewards
         plt.figure(figsize=(12, 5))
         plt.plot(self.episode_rewards, label='Episode Reward')
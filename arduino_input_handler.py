@@ -1,112 +1,177 @@
-import threading
-import serial
+import os
+import struct
+import time
 from config import *
+from input_pipeline import InputSnapshot
+
+# Binary joystick frame: sync byte, x and y (little-endian uint16), switch, sequence number and an 8-bit sum
+# of the five fields between the sync byte and the checksum
+FRAME_SYNC = 0xA5
+FRAME = struct.Struct('<BHHBBB')
+MAX_BUFFERED_BYTES = 4096
+
+
+def encode_frame(x, y, switch, seq):
+    """A binary frame as the firmware sends it."""
+    fields = FRAME.pack(FRAME_SYNC, x, y, switch, seq & 0xFF, 0)[1:-1]
+    return bytes([FRAME_SYNC]) + fields + bytes([sum(fields) & 0xFF])
+
+
+def parse_ascii_sample(line):
+    """(x, y, switch) from an 'X:503,Y:499,Switch Value:1' line sent by the ASCII firmware, or None."""
+    try:
+        parts = line.decode('ascii').strip().split(',')
+        return int(parts[0].split(':')[1]), int(parts[1].split(':')[1]), int(parts[2].split(':')[1])
+    except (IndexError, ValueError, UnicodeDecodeError):
+        return None
+
+
+class SerialDecoder:
+    """Decodes joystick samples from serial bytes as they arrive, in whatever chunks they come.
+
+    Accepts binary frames and the ASCII lines of older firmware alike - ASCII never contains the sync byte.
+    A frame that fails its checksum is skipped up to the next sync byte. Bad frames and unparsable lines are
+    counted as corrupt, and gaps in the frame sequence numbers (lost or corrupt frames) as dropped.
+    """
 
-class Joystick:
     def __init__(self):
-        self.joystick_x = 503
-        self.joystick_y = 499
-        self.joystick_switch = 1
-        self.velocity_x = 0
-        self.velocity_y = 0
-
-    def start_reading(self):
-        if USE_KEYBOARD:
-            keyboard_thread = threading.Thread(target=self.read_keyboard, daemon=True)
-            keyboard_thread.start()
-        if USE_ARDUINO:
-            serial_thread = threading.Thread(target=self.read_serial, daemon=True)
-            serial_thread.start()
-
-    def read_serial(self):
-        while True:
-            line = ser.readline().decode('utf-8').strip()
-            if line:
-                try:
-                    parts = line.split(',')
-                    x_part = parts[0].split(':')[1]
-                    y_part = parts[1].split(':')[1]
-                    switch = parts[2].split(':')[1]
-                    self.joystick_x = int(x_part)
-                    self.joystick_y = int(y_part)
-                    self.joystick_switch = int(switch)
-                except (IndexError, ValueError):
-                    pass
-
-    def read_keyboard(self):
+        self.buffer = bytearray()
+        self.frames = 0
+        self.corrupt = 0
+        self.dropped = 0
+        self.last_seq = None
+
+    def feed(self, data):
+        """Decode every complete frame or line in the buffered bytes, returning the latest (x, y, switch) sample
+        or None if there wasn't one."""
+        buffer = self.buffer
+        buffer += data
+        latest = None
+        pos = 0
+
         while True:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-
-            keys = pygame.key.get_pressed()
-
-            # Adjust velocity based on key presses
-            if keys[pygame.K_LEFT]:
-                self.velocity_x -= ACCELERATION
-            elif keys[pygame.K_RIGHT]:
-                self.velocity_x += ACCELERATION
-            else:
-                self.velocity_x *= DRIFT
-
-            if keys[pygame.K_UP]:
-                self.velocity_y -= ACCELERATION
-            elif keys[pygame.K_DOWN]:
-                self.velocity_y += ACCELERATION
-            else:
-                self.velocity_y *= DRIFT
-
-            # Cap the velocity to maximum speed
-            self.velocity_x = max(-MAX_SPEED, min(MAX_SPEED, self.velocity_x))
-            self.velocity_y = max(-MAX_SPEED, min(MAX_SPEED, self.velocity_y))
-
-            pygame.time.wait(10)  # A small delay to make movement smooth
-
-    def get_velocity(self):
-        if USE_KEYBOARD:
-            keys = pygame.key.get_pressed()
-
-            # Adjust velocity based on key presses
-            if keys[pygame.K_LEFT]:
-                self.velocity_x -= ACCELERATION
-            elif keys[pygame.K_RIGHT]:
-                self.velocity_x += ACCELERATION
-            else:
-                self.velocity_x *= DRIFT
-
-            if keys[pygame.K_UP]:
-                self.velocity_y -= ACCELERATION
-            elif keys[pygame.K_DOWN]:
-                self.velocity_y += ACCELERATION
-            else:
-                self.velocity_y *= DRIFT
-
-            # Cap the velocity to maximum speed
-            self.velocity_x = max(-MAX_SPEED, min(MAX_SPEED, self.velocity_x))
-            self.velocity_y = max(-MAX_SPEED, min(MAX_SPEED, self.velocity_y))
-
-            pygame.time.wait(10)  # A small delay to make movement smooth
-
-        if USE_ARDUINO:
-            dead_zone = 100
-            inverted_x = 1023 - self.joystick_x
-            inverted_y = 1023 - self.joystick_y
-
-            if inverted_x < (512 - dead_zone):
-                self.velocity_x -= ACCELERATION
-            elif inverted_x > (512 + dead_zone):
-                self.velocity_x += ACCELERATION
-            else:
-                self.velocity_x *= DRIFT
-
-            if inverted_y < (512 - dead_zone):
-                self.velocity_y -= ACCELERATION
-            elif inverted_y > (512 + dead_zone):
-                self.velocity_y += ACCELERATION
-            else:
-                self.velocity_y *= DRIFT
-
-            self.velocity_x = max(-MAX_SPEED, min(MAX_SPEED, self.velocity_x))
-            self.velocity_y = max(-MAX_SPEED, min(MAX_SPEED, self.velocity_y))
-
-        return self.velocity_x, self.velocity_y
+            sync = buffer.find(FRAME_SYNC, pos)
+            newline = buffer.find(b'\n', pos)
+
+            if newline != -1 and (sync == -1 or newline < sync):
+                # An ASCII line ends before the next frame starts
+                line = buffer[pos:newline]
+                pos = newline + 1
+                if line.strip():
+                    sample = parse_ascii_sample(line)
+                    if sample is None:
+                        self.corrupt += 1
+                    else:
+                        latest = sample
+                        self.frames += 1
+                continue
+
+            if sync == -1 or len(buffer) - sync < FRAME.size:
+                # Wait for the rest of the line or frame (bytes before a frame's sync byte are skipped)
+                pos = pos if sync == -1 else sync
+                break
+
+            _, x, y, switch, seq, checksum = FRAME.unpack_from(buffer, sync)
+            if sum(buffer[sync + 1:sync + FRAME.size - 1]) & 0xFF != checksum:
+                # Resync at the next sync byte - the bytes up to it are binary, so never an ASCII line
+                self.corrupt += 1
+                pos = buffer.find(FRAME_SYNC, sync + 1)
+                if pos == -1:
+                    pos = len(buffer)
+                continue
+
+            if self.last_seq is not None:
+                self.dropped += (seq - self.last_seq - 1) % 256
+            self.last_seq = seq
+            self.frames += 1
+            latest = (x, y, switch)
+            pos = sync + FRAME.size
+
+        del buffer[:pos]
+        if len(buffer) > MAX_BUFFERED_BYTES:
+            # Never going to parse - a stream of noise, or a device at the wrong baud rate
+            self.corrupt += 1
+            buffer.clear()
+
+        return latest
+
+
+def open_serial_port(port=SERIAL_PORT, baud_rate=BAUD_RATE):
+    """The Arduino's serial connection - pyserial is only imported when a joystick is actually used."""
+    import serial
+
+    try:
+        return serial.Serial(port, baud_rate, timeout=1)
+    except Exception as e:
+        raise RuntimeError(f'Error with Serial Monitor: {e}')
+
+
+class ArduinoSource:
+    """The Arduino joystick, read without blocking: each sample() decodes whatever bytes have arrived since the
+    last one and keeps only the latest reading."""
+
+    human = True
+
+    def __init__(self, port=None):
+        # Serial port of the Arduino (opened from config's SERIAL_PORT by default) and the decoder of its byte
+        # stream
+        self.port = open_serial_port() if port is None else port
+        self.decoder = SerialDecoder()
+        self.snapshot = InputSnapshot(503, 499)
+
+    def sample(self):
+        waiting = self.port.in_waiting
+        if waiting:
+            reading = self.decoder.feed(self.port.read(waiting))
+            if reading is not None:
+                # Stamped when read - at most a tick after it arrived
+                self.snapshot = InputSnapshot(*reading, sample_time=time.perf_counter())
+        return self.snapshot
+
+
+def self_check():
+    """Feed SerialDecoder a stream with frames split across reads, a corrupt frame, a gap in the sequence and
+    ASCII lines - through a pseudo-terminal standing in for the Arduino where there is one - and check what it
+    decodes and counts."""
+    corrupt_frame = bytearray(encode_frame(600, 600, 1, 3))
+    corrupt_frame[-1] ^= 0xFF
+    stream = (encode_frame(100, 200, 1, 0) + encode_frame(110, 210, 1, 1) + encode_frame(120, 220, 0, 2)
+              + bytes(corrupt_frame)  # sequence 3, bad checksum
+              + encode_frame(130, 230, 1, 5)  # sequence 4 never sent
+              + b'X:503,Y:499,Switch Value:1\r\n' + b'not a sample\n' + encode_frame(140, 240, 1, 6))
+    chunks = [stream[i:i + 5] for i in range(0, len(stream), 5)]  # every frame split across reads
+
+    decoder = SerialDecoder()
+    samples = []
+    try:
+        import pty
+        import tty
+        master, slave = pty.openpty()
+        tty.setraw(slave)
+    except (ImportError, OSError):
+        master = slave = None  # no pseudo-terminals here - feed the chunks straight in
+    try:
+        for chunk in chunks:
+            if master is not None:
+                os.write(master, chunk)
+                chunk = os.read(slave, 4096)
+            sample = decoder.feed(chunk)
+            if sample is not None:
+                samples.append(sample)
+    finally:
+        if master is not None:
+            os.close(master)
+            os.close(slave)
+
+    assert samples[-1] == (140, 240, 1), samples
+    assert (100, 200, 1) in samples and (503, 499, 1) in samples and (600, 600, 1) not in samples, samples
+    assert decoder.frames == 6, decoder.frames
+    assert decoder.corrupt == 2, decoder.corrupt  # the bad frame and the unparsable line
+    assert decoder.dropped == 2, decoder.dropped  # sequences 3 and 4
+    assert not decoder.buffer
+    print(f'SerialDecoder ok{"" if master is not None else " (without a pseudo-terminal)"}: {decoder.frames} '
+          f'samples, {decoder.corrupt} corrupt, {decoder.dropped} dropped')
+
+
+if __name__ == '__main__':
+    self_check()
@@ -0,0 +1,177 @@
+import hashlib
+import os
+import struct
+
+import pygame
+from config import *
+
+# Cached surface files start with the width, height and whether there is an alpha channel, followed by the
+# pixels as BGRA or RGB bytes. BGRA loads as the same 32-bit layout as an offscreen screen surface, so sprites
+# blit straight onto it even without a display to convert them for
+CACHE_HEADER = struct.Struct('<II?')
+CACHE_FORMAT = 2  # bumped whenever the file layout changes, so old cache files are ignored
+
+
+class ImageSpec:
+    """An image file and how the game uses it: flipped vertically if flip_y, then scaled to size, or to
+    1/divisor of its own size."""
+
+    def __init__(self, path, size=None, divisor=None, flip_y=False):
+        self.path = path
+        self.size = size
+        self.divisor = divisor
+        self.flip_y = flip_y
+
+    def key(self):
+        return f'size={self.size} divisor={self.divisor} flip_y={self.flip_y}'
+
+    def prepare(self, surface):
+        if self.flip_y:
+            surface = pygame.transform.flip(surface, False, True)
+        size = self.size or (surface.get_width() // self.divisor, surface.get_height() // self.divisor)
+        return pygame.transform.scale(surface, size)
+
+
+class SoundSpec:
+    """A sound file, its volume, and the mixer channel it plays on."""
+
+    def __init__(self, path, volume, channel):
+        self.path = path
+        self.volume = volume
+        self.channel = channel
+
+
+IMAGES = {
+    'character': ImageSpec('images/50.png', size=(CHARACTER_WIDTH, CHARACTER_HEIGHT)),
+    'bullet': ImageSpec('images/bullet.png', size=(BULLET_WIDTH, BULLET_HEIGHT), flip_y=True),
+    'money': ImageSpec('images/money.png', size=(MONEY_WIDTH, MONEY_HEIGHT)),
+    'bank': ImageSpec('images/bank.png', size=(BANK_SIZE, BANK_SIZE)),
+    'background': ImageSpec('images/background.jpg', size=(TILE_WIDTH, TILE_HEIGHT)),
+    'end': ImageSpec('images/end.png', size=(300, 380)),
+    'heart': ImageSpec('images/heart.png', size=(50, 50)),
+}
+
+SOUNDS = {
+    'gunshot': SoundSpec('sounds/gunshot.mp3', 0.1, 0),
+    'background': SoundSpec('sounds/background.mp3', 0.1, 1),
+    'cash': SoundSpec('sounds/cash.mp3', 0.4, 2),
+}
+
+
+class AssetManager:
+    """Images and sounds, loaded the first time they are used.
+
+    Images are decoded and scaled once, then kept in cache_dir as raw pixels, in files named by a hash of the
+    source file and how it was scaled - later runs (and every worker process) read them back without decoding
+    or scaling, and image_size() only reads a file's header. Surfaces are converted to the display's pixel
+    format once there is a display. Sounds are only loaded while an audio backend (the mixer) is active, and
+    playing one without it does nothing.
+    """
+
+    def __init__(self, images=IMAGES, sounds=SOUNDS, cache_dir=ASSET_CACHE_DIR):
+        self.images = images
+        self.sounds = sounds
+        self.cache_dir = cache_dir
+
+        self.surfaces = {}
+        self.display_ready = set()  # names of surfaces already converted to the display format
+        self.sizes = {}
+        self.cache_paths = {}
+        self.loaded_sounds = {}
+
+    def image(self, name):
+        surface = self.surfaces.get(name)
+        if surface is None:
+            surface = self.surfaces[name] = self._load_image(name)
+        if name not in self.display_ready and pygame.display.get_surface() is not None:
+            if surface.get_flags() & pygame.SRCALPHA:
+                surface = surface.convert_alpha()
+            else:
+                surface = surface.convert()
+            self.surfaces[name] = surface
+            self.display_ready.add(name)
+        return surface
+
+    def image_size(self, name):
+        """(width, height) of an image as the game draws it - without touching the file when its spec gives the
+        size, and without loading its pixels if it is cached."""
+        size = self.sizes.get(name)
+        if size is None:
+            if self.images[name].size is not None:
+                size = self.images[name].size
+            elif name in self.surfaces:
+                size = self.surfaces[name].get_size()
+            else:
+                try:
+                    with open(self._cache_path(name), 'rb') as f:
+                        size = CACHE_HEADER.unpack(f.read(CACHE_HEADER.size))[:2]
+                except (OSError, struct.error):
+                    size = self.image(name).get_size()
+            self.sizes[name] = size = tuple(size)
+        return size
+
+    def _cache_path(self, name):
+        path = self.cache_paths.get(name)
+        if path is None:
+            spec = self.images[name]
+            digest = hashlib.sha1()
+            with open(spec.path, 'rb') as f:
+                digest.update(f.read())
+            digest.update(f'{spec.key()} format={CACHE_FORMAT}'.encode())
+            path = self.cache_paths[name] = os.path.join(self.cache_dir, f'{name}-{digest.hexdigest()[:16]}.surface')
+        return path
+
+    def _load_image(self, name):
+        path = self._cache_path(name)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            width, height, alpha = CACHE_HEADER.unpack_from(data)
+            return pygame.image.frombytes(data[CACHE_HEADER.size:], (width, height), 'BGRA' if alpha else 'RGB')
+        except (OSError, struct.error, ValueError):
+            pass
+
+        surface = self.images[name].prepare(pygame.image.load(self.images[name].path))
+        alpha = bool(surface.get_flags() & pygame.SRCALPHA)
+        pixel_format = 'BGRA' if alpha else 'RGB'
+        pixels = pygame.image.tobytes(surface, pixel_format)
+        try:
+            # Write to a temporary file and rename it into place, so processes filling the cache at the same
+            # time never read a half-written file
+            os.makedirs(self.cache_dir, exist_ok=True)
+            temp_path = f'{path}.{os.getpid()}.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(CACHE_HEADER.pack(surface.get_width(), surface.get_height(), alpha))
+                f.write(pixels)
+            os.replace(temp_path, path)
+        except OSError:
+            pass  # a read-only checkout just goes without the cache
+        return pygame.image.frombytes(pixels, surface.get_size(), pixel_format)
+
+    def sound(self, name):
+        """The named sound at its volume, or None when no audio backend is active."""
+        if not pygame.mixer.get_init():
+            return None
+        sound = self.loaded_sounds.get(name)
+        if sound is None:
+            spec = self.sounds[name]
+            sound = self.loaded_sounds[name] = pygame.mixer.Sound(spec.path)
+            sound.set_volume(spec.volume)
+        return sound
+
+    def play(self, name, restart=True):
+        """Play a sound on its channel, starting it over if it is already playing unless restart is False."""
+        sound = self.sound(name)
+        if sound is None:
+            return
+        channel = pygame.mixer.Channel(self.sounds[name].channel)
+        if restart or not channel.get_busy():
+            channel.play(sound)
+
+    def stop(self, name):
+        if pygame.mixer.get_init():
+            pygame.mixer.Channel(self.sounds[name].channel).stop()
+
+
+# Shared by everything that draws or plays sounds
+assets = AssetManager()
@@ -0,0 +1,551 @@
+"""Throughput benchmarks for the simulation, rendering and RL environments, run headless (SDL dummy drivers) so
+they work on a CPU-only box with no display or sound card.
+
+    python benchmark.py                                   # every group, results written to benchmark.json
+    python benchmark.py --only update render --repeats 3  # just some groups
+    python benchmark.py --output baseline.json            # store a baseline...
+    python benchmark.py --compare baseline.json           # ...and exit 1 if anything is slower by > --tolerance
+
+Each result is the best of --repeats timed runs over the same seeded games, so runs are repeatable and the
+noise of a busy machine only ever makes a result look slower, never faster.
+"""
+import os
+
+# Headless SDL before pygame is first imported - gym points SDL audio at dsp on import, so put it back after
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+audio_driver = os.environ['SDL_AUDIODRIVER']
+import gym
+os.environ['SDL_AUDIODRIVER'] = audio_driver
+
+import argparse
+import json
+import multiprocessing as mp
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from functools import partial
+
+import numpy as np
+import pygame
+
+from config import *
+from main import Game
+from game_env import MyGameEnv
+from input_pipeline import AgentSource
+from game_objects import BulletManager, BULLET_WIDTH, BULLET_HEIGHT
+from sim_clock import SimClock
+from assets import assets
+from reward_engine import StepGeometry, REWARD_TERMS
+
+# Benchmark groups by name, in the order they run
+BENCHMARKS = {}
+
+# Bullet-heavy late-game settings for the stress group: every bullet slot in use, fast bullets, and a spawn
+# each step. Levelling up is turned off so the settings hold for the whole run
+STRESS = {'max_bullets': BULLET_CAPACITY, 'bullet_speed': 15, 'bullet_interval_max': SIM_DT / 2}
+
+SEED = 0
+
+# Import-time budgets (ms) of the simulation and environment modules, over and above importing numpy, pygame
+# and gym themselves. Importing them must also leave pygame uninitialised (no display or audio device opened)
+# and not pull in any of IMPORT_DEFERRED - those are only imported by the features that use them
+IMPORT_BUDGETS_MS = {
+    'config': 5,
+    'sim_clock': 5,
+    'reward_engine': 10,
+    'input_pipeline': 10,
+    'game_objects': 25,
+    'vec_game': 30,
+    'main': 40,
+    'game_env': 50,
+}
+IMPORT_DEFERRED = ('cv2', 'matplotlib', 'serial', 'torch')
+
+# Run in a fresh interpreter per module, so nothing is already imported
+IMPORT_PROBE = '''
+import json, os, sys, time
+import numpy, pygame, gym
+before = set(sys.modules)
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{
+    'seconds': seconds,
+    'imported': sorted(name for name in set(sys.modules) - before if name.split('.')[0] in {deferred!r}),
+    'initialised': [name for name, initialised in (('pygame', pygame.get_init()),
+                    ('display', pygame.display.get_init()), ('mixer', pygame.mixer.get_init())) if initialised],
+    'cache_files': sorted(os.listdir(os.environ['ASSET_CACHE_DIR'])) if os.path.isdir(os.environ['ASSET_CACHE_DIR'])
+                   else [],
+}}))
+'''
+
+
+def benchmark(name):
+    """Register a benchmark group under `name` - a function of the parsed arguments returning its results."""
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def rate(value, unit='steps/s'):
+    return {'value': value, 'unit': unit, 'higher_is_better': True}
+
+
+def frame_time(value):
+    return {'value': value, 'unit': 'ms', 'higher_is_better': False}
+
+
+def best_time(run, n, repeats):
+    """Fastest of `repeats` timings of run(n), in seconds."""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run(n)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def random_actions(n=1000):
+    return np.random.default_rng(SEED).uniform(-1, 1, size=(n, 2)).astype(np.float32)
+
+
+def make_game(stress=False):
+    """A seeded headless game steered by random agent actions, and a function playing n steps of it."""
+    source = AgentSource()
+    game = Game(headless=True, seed=SEED, input_source=source)
+    actions = random_actions()
+    if stress:
+        apply_stress(game)
+
+    def play(n):
+        for i in range(n):
+            source.act(actions[i % len(actions)])
+            game.update()
+            if stress:
+                game.character.health = START_HEALTH
+            elif game.game_over:
+                game.reset_game()
+
+    return game, play
+
+
+def apply_stress(game):
+    game.max_bullets = STRESS['max_bullets']
+    game.bullet_speed = STRESS['bullet_speed']
+    game.bullet_interval_max = STRESS['bullet_interval_max']
+    game.bullet_manager.bullet_interval_min = 0.0
+    game.leveler = float('inf')
+
+
+def make_env(stress=False, **kwargs):
+    """A seeded MyGameEnv, and a function taking n random-action steps of it."""
+    env = MyGameEnv(**kwargs)
+    env.seed(SEED)
+    env.reset()
+    actions = random_actions()
+    if stress:
+        apply_stress(env.game)
+
+    def play(n):
+        for i in range(n):
+            _, _, done, _ = env.step(actions[i % len(actions)])
+            if stress:
+                env.game.character.health = START_HEALTH
+            elif done:
+                env.reset()
+
+    return env, play
+
+
+def steps_per_second(play, n, repeats):
+    play(max(1, n // 10))  # warm up
+    return n / best_time(play, n, repeats)
+
+
+def render_ms(game, play, n, repeats):
+    """Game.render time per frame, in ms, with the game played a step between frames as it is in real play -
+    only the rendering is timed."""
+    best = float('inf')
+    for _ in range(repeats):
+        elapsed = 0.0
+        for _ in range(n):
+            play(1)
+            start = time.perf_counter()
+            game.render()
+            elapsed += time.perf_counter() - start
+        best = min(best, elapsed)
+    return best / n * 1000
+
+
+def scaled(args, n):
+    return max(1, int(n * args.scale))
+
+
+@benchmark('update')
+def bench_update(args):
+    """Game.update alone - the simulation with no drawing, observations or rewards."""
+    _, play = make_game()
+    return {'game.update': rate(steps_per_second(play, scaled(args, 5000), args.repeats))}
+
+
+@benchmark('env')
+def bench_env(args):
+    """MyGameEnv.step headless, with the window drawn and presented every step, and with pixel observations."""
+    results = {}
+    n = scaled(args, 2000)
+    for name, kwargs in (('env.step', {'headless': True}), ('env.step.rendered', {'headless': False}),
+                         ('env.step.pixels', {'headless': True, 'obs_type': 'pixels'})):
+        env, play = make_env(**kwargs)
+        results[name] = rate(steps_per_second(play, n, args.repeats))
+        env.close()
+    return results
+
+
+@benchmark('obs_reward')
+def bench_obs_reward(args):
+    """_get_obs and the reward functions in isolation, on a mid-game state with bullets on screen.
+
+    The step geometry the reward terms share is rebuilt on every call, as it is once per step.
+    """
+    env, play = make_env(headless=True)
+    play(300)
+    n = scaled(args, 20000)
+    results = {'env.obs': rate(steps_per_second(lambda n: [env._get_obs() for _ in range(n)], n, args.repeats),
+                               'calls/s')}
+
+    def reward_rate(reward_function):
+        def run(n):
+            for _ in range(n):
+                env.geometry = None
+                reward_function()
+        return rate(steps_per_second(run, n, args.repeats), 'calls/s')
+
+    results['reward.v1'] = reward_rate(env._calculate_reward)
+    results['reward.v2'] = reward_rate(env._calculate_rewards_v2)
+    results['reward.exploration'] = reward_rate(env._exploration_reward)
+
+    # Each registered term on its own, over a fresh geometry (so it pays for the quantities it derives)
+    for name, kernel in REWARD_TERMS.items():
+        def run(n, kernel=kernel):
+            for _ in range(n):
+                kernel(StepGeometry.from_game(env.game, env.initial_health))
+        results[f'reward.term.{name}'] = rate(steps_per_second(run, n, args.repeats), 'calls/s')
+
+    env.close()
+    return results
+
+
+@benchmark('render')
+def bench_render(args):
+    """Game.render frame time, redrawing the whole screen and with dirty rects (which only save work when
+    SCROLL_SPEED is 0 - a scrolling background is redrawn whole every frame)."""
+    results = {}
+    n = scaled(args, 300)
+    for name, dirty_rects in (('render', False), ('render.dirty_rects', True)):
+        game, play = make_game()
+        game.dirty_rects = dirty_rects
+        play(300)
+        results[name] = frame_time(render_ms(game, play, n, args.repeats))
+    return results
+
+
+@benchmark('stress')
+def bench_stress(args):
+    """The simulation, rendering and env step with every bullet slot in use at high bullet speed."""
+    game, play = make_game(stress=True)
+    play(300)
+    bullets = game.bullet_manager.count()
+    results = {
+        'stress.game.update': rate(steps_per_second(play, scaled(args, 5000), args.repeats)),
+        'stress.render': frame_time(render_ms(game, play, scaled(args, 300), args.repeats)),
+    }
+
+    env, play = make_env(stress=True, headless=True)
+    play(300)
+    results['stress.env.step'] = rate(steps_per_second(play, scaled(args, 2000), args.repeats))
+    results['stress.env.obs'] = rate(steps_per_second(lambda n: [env._get_obs() for _ in range(n)],
+                                                      scaled(args, 20000), args.repeats), 'calls/s')
+    env.close()
+
+    for result in results.values():
+        result['bullets'] = int(bullets)
+    return results
+
+
+@benchmark('sprites')
+def bench_sprites(args):
+    """Drawing --sprite-bullets bullets spread over the screen: BulletManager.draw (one Surface.blits call), the
+    same bullets blitted one call at a time, and BulletManager.draw with 1x1 pixel bullets - the interpreter and
+    call overhead on its own. pixel_share is the fraction of the draw spent on pixels."""
+    game, _ = make_game()
+    game.render()
+    screen = game.screen
+
+    n_bullets = args.sprite_bullets
+    rng = np.random.default_rng(SEED)
+    bullets = BulletManager(SimClock(), capacity=n_bullets, rng=random.Random(SEED))
+    bullets.x[:] = rng.uniform(0, WINDOW_SIZE - BULLET_WIDTH, n_bullets)
+    bullets.y[:] = rng.uniform(0, WINDOW_SIZE - BULLET_HEIGHT, n_bullets)
+    bullets.active[:] = True
+    bullets.seq[:] = np.arange(n_bullets)
+
+    n = scaled(args, 20)
+
+    def draw_ms(draw):
+        draw()
+        return best_time(lambda n: [draw() for _ in range(n)], n, args.repeats) / n * 1000
+
+    results = {
+        'sprites.draw': frame_time(draw_ms(lambda: bullets.draw(screen))),
+        'sprites.blit_loop': frame_time(draw_ms(lambda: [screen.blit(*sprite) for sprite in bullets.sprites()])),
+    }
+
+    bullet_image = assets.image('bullet')
+    assets.surfaces['bullet'] = pygame.Surface((1, 1), pygame.SRCALPHA)
+    try:
+        results['sprites.overhead'] = frame_time(draw_ms(lambda: bullets.draw(screen)))
+    finally:
+        assets.surfaces['bullet'] = bullet_image
+
+    pixel_share = 1 - results['sprites.overhead']['value'] / results['sprites.draw']['value']
+    for result in results.values():
+        result['bullets'] = n_bullets
+    results['sprites.draw']['pixel_share'] = pixel_share
+    return results
+
+
+@benchmark('replay')
+def bench_replay(args):
+    """MyGameEnv.step while recording every episode, replaying the recorded episodes from their seeds, seeking
+    to the last tick of the longest one from a snapshot, and scanning the file."""
+    from replay import EpisodeRecorder, ReplayFile, replay
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.replay')
+        recorder = EpisodeRecorder(path)
+        env, play = make_env(headless=True, recorders=[recorder])
+        results = {'replay.record': rate(steps_per_second(play, scaled(args, 5000), args.repeats))}
+        recorder.close()
+        env.close()
+
+        episodes = ReplayFile(path).episodes
+        ticks = sum(episode.ticks for episode in episodes)
+        longest = max(episodes, key=lambda episode: episode.ticks)
+
+        def replay_all(n):
+            for episode in episodes:
+                replay(episode, use_snapshots=False)
+
+        results['replay.replay'] = rate(ticks / best_time(replay_all, ticks, args.repeats), 'ticks/s')
+        results['replay.seek'] = frame_time(best_time(lambda n: replay(longest, longest.ticks - 1), 1,
+                                                      args.repeats) * 1000)
+        results['replay.scan'] = frame_time(best_time(lambda n: ReplayFile(path), 1, args.repeats) * 1000)
+        results['replay.scan']['episodes'] = len(episodes)
+        del episodes, longest  # let go of the file's memory map before the directory is removed
+    return results
+
+
+@benchmark('vec')
+def bench_vec(args):
+    """Env-steps/sec of the batched MyGameVecEnv, and of SharedMemoryVecEnv over 1..--workers processes."""
+    from vec_game_env import MyGameVecEnv
+    from env_pool import SharedMemoryVecEnv
+
+    results = {}
+    n = scaled(args, 200)
+
+    def vec_rate(env):
+        actions = np.random.default_rng(SEED).uniform(-1, 1, size=(env.num_envs, 2)).astype(np.float32)
+        env.seed(SEED)
+        env.reset()
+
+        def run(n):
+            for _ in range(n):
+                env.step(actions)
+        return rate(steps_per_second(run, n, args.repeats) * env.num_envs, 'env-steps/s')
+
+    env = MyGameVecEnv(args.vec_envs)
+    results[f'vec.batched.{args.vec_envs}'] = vec_rate(env)
+    env.close()
+
+    env_fn = partial(MyGameEnv, headless=True)
+    for n_workers in range(1, args.workers + 1):
+        env = SharedMemoryVecEnv(env_fn, n_envs=n_workers * args.envs_per_worker, n_workers=n_workers)
+        results[f'vec.workers.{n_workers}'] = vec_rate(env)
+        env.close()
+    return results
+
+
+@benchmark('ppo')
+def bench_ppo(args):
+    """PPO training env-steps/sec (rollouts and updates) over 1..--workers processes, on the CPU."""
+    from stable_baselines3 import PPO
+    from env_pool import SharedMemoryVecEnv
+
+    results = {}
+    n_steps = 128
+    env_fn = partial(MyGameEnv, headless=True)
+    for n_workers in range(1, args.workers + 1):
+        env = SharedMemoryVecEnv(env_fn, n_envs=n_workers * args.envs_per_worker, n_workers=n_workers)
+        model = PPO('MlpPolicy', env, n_steps=n_steps, batch_size=64, n_epochs=1, device='cpu', seed=SEED)
+        timesteps = scaled(args, 4) * n_steps * env.num_envs
+        model.learn(n_steps * env.num_envs)  # warm up
+        results[f'ppo.workers.{n_workers}'] = rate(timesteps / best_time(model.learn, timesteps, args.repeats),
+                                                   'env-steps/s')
+        env.close()
+    return results
+
+
+@benchmark('imports')
+def bench_imports(args):
+    """Import time of each module in IMPORT_BUDGETS_MS in a fresh interpreter (best of --repeats), checked
+    against its budget and for side effects. Results failing a check are marked with a 'failed' reason.
+
+    Each import runs against an empty asset cache, as a freshly spawned worker's first might, and must leave it
+    empty.
+    """
+    results = {}
+    for module, budget in IMPORT_BUDGETS_MS.items():
+        probe = IMPORT_PROBE.format(module=module, deferred=IMPORT_DEFERRED)
+        runs = []
+        for _ in range(args.repeats):
+            with tempfile.TemporaryDirectory() as cache_dir:
+                process = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True,
+                                         cwd=os.path.dirname(os.path.abspath(__file__)),
+                                         env=dict(os.environ, ASSET_CACHE_DIR=cache_dir))
+            if process.returncode != 0:
+                break
+            runs.append(json.loads(process.stdout.splitlines()[-1]))
+
+        if not runs:
+            error = process.stderr.strip().splitlines()
+            results[f'import.{module}'] = dict(frame_time(float('nan')), budget_ms=budget,
+                                               failed=f"import failed: {error[-1] if error else process.returncode}")
+            continue
+
+        result = frame_time(min(run['seconds'] for run in runs) * 1000)
+        result['budget_ms'] = budget
+        problems = []
+        if result['value'] > budget:
+            problems.append(f"{result['value']:.1f} ms is over the {budget} ms budget")
+        if runs[0]['imported']:
+            problems.append(f"imports {', '.join(runs[0]['imported'])}")
+        if runs[0]['initialised']:
+            problems.append(f"initialises {', '.join(runs[0]['initialised'])}")
+        if runs[0]['cache_files']:
+            problems.append(f"writes the asset cache ({', '.join(runs[0]['cache_files'])})")
+        if problems:
+            result['failed'] = '; '.join(problems)
+        results[f'import.{module}'] = result
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(args):
+    meta = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'pygame': pygame.version.ver,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': mp.cpu_count(),
+        'repeats': args.repeats,
+        'scale': args.scale,
+        'stress': STRESS,
+    }
+    results, skipped, failures = {}, {}, {}
+    for name in args.only or BENCHMARKS:
+        print(f'{name}...', flush=True)
+        try:
+            group = BENCHMARKS[name](args)
+        except ImportError as e:
+            skipped[name] = f'missing dependency: {e}'
+            print(f'  skipped ({skipped[name]})')
+            continue
+        for result_name, result in group.items():
+            print(f"  {result_name:40s} {result['value']:12.2f} {result['unit']}"
+                  f"{'  FAILED: ' + result['failed'] if 'failed' in result else ''}")
+            if 'failed' in result:
+                failures[result_name] = result['failed']
+        results.update(group)
+    return {'meta': meta, 'results': results, 'skipped': skipped, 'failures': failures}
+
+
+def compare(report, baseline, tolerance):
+    """Print each result against the baseline, returning the names of those worse by more than tolerance."""
+    for key in ('platform', 'processor', 'cpu_count'):
+        if baseline['meta'].get(key) != report['meta'].get(key):
+            print(f"note: baseline {key} was {baseline['meta'].get(key)!r}, now {report['meta'].get(key)!r}")
+
+    regressions = []
+    print(f"\n{'benchmark':40s} {'baseline':>12s} {'current':>12s} {'change':>8s}")
+    for name, result in report['results'].items():
+        base = baseline['results'].get(name)
+        if base is None or base['value'] <= 0 or result['value'] <= 0:
+            continue
+        # Speedup over the baseline - below 1 is slower, whichever way round the unit goes
+        speedup = result['value'] / base['value']
+        if not result['higher_is_better']:
+            speedup = 1 / speedup
+        regressed = speedup < 1 - tolerance
+        if regressed:
+            regressions.append(name)
+        print(f"{name:40s} {base['value']:12.2f} {result['value']:12.2f} {speedup - 1:+8.1%}"
+              f"{'  REGRESSION' if regressed else ''}")
+
+    missing = sorted(set(baseline['results']) - set(report['results']))
+    if missing:
+        print(f"not run this time: {', '.join(missing)}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the game, its rendering and the RL environments.')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='benchmark groups to run (default all)')
+    parser.add_argument('--repeats', type=int, default=5, help='timed runs per benchmark - the best is kept')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier on the steps timed per run')
+    parser.add_argument('--workers', type=int, default=mp.cpu_count(), help='most worker processes to try')
+    parser.add_argument('--envs-per-worker', type=int, default=8)
+    parser.add_argument('--sprite-bullets', type=int, default=5000, help='bullets drawn by the sprites group')
+    parser.add_argument('--vec-envs', type=int, default=256, help='games in the batched vec env')
+    parser.add_argument('--output', default='benchmark.json', help='where to write the results JSON')
+    parser.add_argument('--compare', metavar='BASELINE', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='fraction slower than the baseline that counts as a regression')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_benchmarks(args)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'results written to {args.output}')
+    status = 1 if report['failures'] else 0
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,6 @@
-import pygame
-import serial
-
-# Initialize Pygame
-pygame.init()
-pygame.mixer.init()
+# Settings only - importing config has no side effects. pygame is initialised by the Game that needs it, and
+# the Arduino's serial port is opened by the input source that reads it
+import os
 
 # Define colors
 RED = (255, 0, 0)
@@ -15,6 +12,21 @@ BOARD_SIZE = 8
 SQUARE_SIZE = 100
 WINDOW_SIZE = BOARD_SIZE * SQUARE_SIZE
 
+# Simulation clock - the game advances one fixed step of SIM_DT seconds per update
+SIM_FPS = 30
+SIM_DT = 1.0 / SIM_FPS
+
+# Interactive loop: frames are drawn at up to RENDER_FPS (0 for uncapped), interpolating between simulation
+# steps. After a stall at most MAX_CATCH_UP_STEPS steps run before the next frame - the rest is dropped
+RENDER_FPS = 60
+MAX_CATCH_UP_STEPS = 5
+
+# Simulation timer names
+BULLET_SPAWN_TIMER = 'bullet_spawn'
+MONEY_RESPAWN_TIMER = 'money_respawn'
+COLLECTION_MSG_TIMER = 'collection_message'
+LEVEL_UP_MSG_TIMER = 'level_up_message'
+
 # Character settings
 CHARACTER_WIDTH = 200
 CHARACTER_HEIGHT = 200
@@ -22,6 +34,7 @@ SENSITIVITY = 2
 ACCELERATION = 0.5
 MAX_SPEED = 10
 DRIFT = 0.9
+DEAD_ZONE = 100  # Joystick readings within this distance of the centre let the character drift
 START_HEALTH = 200
 INITIAL_X = WINDOW_SIZE // 2 - CHARACTER_WIDTH // 2
 INITIAL_Y = WINDOW_SIZE - CHARACTER_HEIGHT - 10
@@ -33,12 +46,16 @@ BULLET_INTERVAL_MIN = 0.5
 BULLET_INTERVAL_MAX = 1.5
 BULLET_INTERVAL_ADJ = 0.2
 BULLET_DAMAGE = 10
+BULLET_WIDTH, BULLET_HEIGHT = 102, 102  # a fifth of images/bullet.png
 LEVELER = 200
 N_LVL_SPEED_INCREASE = 2
 BULLET_INTERVAL_MEAN = 2
 BULLET_INTERVAL_STD = 0.5
+BULLET_CAPACITY = 64  # bullet slots preallocated per game by the array-backed engines, doubled when a level
+                     # allows more bullets than that
 
 # Money settings
+MONEY_WIDTH, MONEY_HEIGHT = 200, 208  # a fifth of images/money.png
 RESPAWN_DELAY_MIN = 1
 RESPAWN_DELAY_MAX = 2
 
@@ -54,13 +71,46 @@ COLLISION_SENSITIVITY = 0.2  # 0.5 means the bounding box is half the size of th
 NUM_TILES = 2
 TILE_HEIGHT = WINDOW_SIZE // NUM_TILES
 TILE_WIDTH = WINDOW_SIZE
-SCROLL_SPEED = 2
+SCROLL_SPEED = 2  # 0 keeps the background still, so dirty-rect rendering only pushes the sprites that moved
+
+# Pixel observations: side of the square grayscale frame, and how many recent frames are stacked
+PIXEL_OBS_SIZE = 84
+PIXEL_FRAME_STACK = 4
+
+# Input-to-photon latency: F3 toggles the in-game overlay, and the measurements are written to LATENCY_LOG
+# (JSON) when the game quits - None to skip
+LATENCY_LOG = None
+
+# Frame profiler: F4 toggles timing with an overlay of ms per phase, F5 writes the trace recorded since to
+# PROFILE_TRACE (Chrome trace-event JSON) - None to skip
+PROFILE_TRACE = None
+
+# Episode recording: every episode of human play is appended to REPLAY_LOG (None to skip) as its seed and
+# joystick input, with a snapshot of the game state every REPLAY_SNAPSHOT_EVERY ticks - see replay.py
+REPLAY_LOG = None
+REPLAY_SNAPSHOT_EVERY = 900
+
+# Demonstrations: human play is written to DATASET_DIR (None to skip) as chunks of DATASET_CHUNK_TICKS ticks of
+# observation, action, reward terms and done, for behavior cloning - see dataset.py
+DATASET_DIR = None
+DATASET_CHUNK_TICKS = 65536
+
+# Push only the screen regions that changed each frame rather than flipping the whole window. Only helps with
+# SCROLL_SPEED = 0 - a scrolling background moves every frame, so the whole screen is redrawn anyway
+DIRTY_RECTS = False
 
 # Colour tuples
 BLOOD_RED = (120, 6, 6)
 MONEY_GREEN = (62, 156, 53)
 SKY_BLUE = (135, 206, 235)
 
+# Rendered text surfaces kept by the HUD text cache
+TEXT_CACHE_SIZE = 128
+
+# Scaled images are cached here as raw pixels after the first run (safe to delete) - the ASSET_CACHE_DIR
+# environment variable overrides it
+ASSET_CACHE_DIR = os.environ.get('ASSET_CACHE_DIR', '.asset_cache')
+
 # Readouts
 LVL_UP_MSG = "Next level - Get the doe homie, they shootin'!"
 
@@ -68,14 +118,5 @@ LVL_UP_MSG = "Next level - Get the doe homie, they shootin'!"
 USE_ARDUINO = False
 USE_KEYBOARD = True
 SERIAL_PORT = 'COM3'
-BAUD_RATE = 9600
-
-if USE_ARDUINO:
-    # Initialize serial connection
-    try:
-        ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)  # Replace 'COM3' with your Arduino's serial port
-    except Exception as e:
-        raise RuntimeError(f'Error with Serial Monitor: {e}')
-
-else:
-    ser = None
+SERIAL_PROTOCOL = 'ascii'  # 'binary' for firmware built with BINARY_PROTOCOL 1 (simpleJoystick.ino)
+BAUD_RATE = 115200 if SERIAL_PROTOCOL == 'binary' else 9600
@@ -0,0 +1,156 @@
+"""Demonstration datasets: what happened on every tick of recorded play, for pretraining agents.
+
+A dataset is a directory of chunks, each a directory holding one .npy file per column with a row per tick:
+
+    obs.npy             float32 (ticks, obs_dim) - the observation the tick's input was given in, as
+                        MyGameEnv._get_obs returns it for 'state' observations
+    action.npy          float32 (ticks, 2) - the joystick reading steering the tick, as an agent action in [-1, 1]
+    done.npy            bool (ticks,) - whether the game was lost on the tick
+    episode.npy         int64 (ticks,) - the episode's seed (the same one replay.py records)
+    reward.<term>.npy   float32 (ticks,) - every registered reward term, unweighted
+
+Chunks are written whole under a temporary name and renamed into place, so a dataset can be read while it is
+being recorded, and several writers can share a directory. TrajectoryDataset memory-maps them and streams
+shuffled minibatches, holding only a few chunks in memory at a time.
+"""
+import os
+import time
+
+import numpy as np
+
+from config import *
+from game_env import state_observation
+from input_pipeline import reading_to_action
+from reward_engine import REWARD_TERMS, StepGeometry
+
+CHUNK_PREFIX = 'chunk-'
+
+
+class TrajectoryWriter:
+    """Writes every tick a Game plays to a dataset directory - pass it to Game (or MyGameEnv) in `recorders`.
+
+    Ticks are buffered and written a chunk of chunk_ticks at a time, and what is left when close() is called.
+    Like replay.EpisodeRecorder, it stops at the end of an episode until the game resets.
+    """
+
+    def __init__(self, directory, chunk_ticks=DATASET_CHUNK_TICKS):
+        self.directory = directory
+        self.chunk_ticks = chunk_ticks
+        os.makedirs(directory, exist_ok=True)
+
+        self.terms = list(REWARD_TERMS.items())
+        self.columns = None  # allocated once the observation size is known
+        self.rows = 0
+
+        self.game = None
+        self.obs = None  # observation the next tick's input is given in
+        self.prev_health = None
+
+    def begin_episode(self, game):
+        if game.input_source is None:
+            raise ValueError('Only games steered by an input source can be recorded')
+        self.game = game
+        self.obs = state_observation(game)
+        self.prev_health = game.character.health
+        if self.columns is None:
+            self.columns = {
+                'obs': np.zeros((self.chunk_ticks, len(self.obs)), dtype=np.float32),
+                'action': np.zeros((self.chunk_ticks, 2), dtype=np.float32),
+                'done': np.zeros(self.chunk_ticks, dtype=bool),
+                'episode': np.zeros(self.chunk_ticks, dtype=np.int64),
+            }
+            for name, _ in self.terms:
+                self.columns[f'reward.{name}'] = np.zeros(self.chunk_ticks, dtype=np.float32)
+
+    def record(self, game):
+        if self.game is None:
+            return  # the episode has ended, and the game is waiting to be reset
+
+        row = self.rows
+        columns = self.columns
+        snapshot = game.input_snapshot
+        columns['obs'][row] = self.obs
+        columns['action'][row] = (reading_to_action(snapshot.x), reading_to_action(snapshot.y))
+        columns['done'][row] = game.game_over
+        columns['episode'][row] = game.episode_seed
+
+        # The terms are judged against the health before the tick, as MyGameEnv.step does
+        geometry = StepGeometry.from_game(game, self.prev_health)
+        for name, kernel in self.terms:
+            columns[f'reward.{name}'][row] = kernel(geometry)
+
+        self.rows += 1
+        if self.rows == self.chunk_ticks:
+            self.flush()
+
+        if game.game_over:
+            self.game = None
+        else:
+            self.obs = state_observation(game)
+            self.prev_health = game.character.health
+
+    def end_episode(self, game):
+        self.game = None
+
+    def flush(self):
+        """Write the buffered ticks as a chunk."""
+        if not self.rows:
+            return
+        name = f'{CHUNK_PREFIX}{time.time_ns():016x}-{os.getpid()}'
+        temp_path = os.path.join(self.directory, f'.{name}.tmp')
+        os.makedirs(temp_path)
+        for column, values in self.columns.items():
+            np.save(os.path.join(temp_path, f'{column}.npy'), values[:self.rows])
+        os.rename(temp_path, os.path.join(self.directory, name))
+        self.rows = 0
+
+    def close(self):
+        self.flush()
+        self.game = None
+
+
+class TrajectoryDataset:
+    """The chunks of a dataset directory, with the given columns of each memory-mapped."""
+
+    def __init__(self, directory, columns=('obs', 'action')):
+        self.directory = directory
+        self.columns = list(columns)
+        self.chunks = []
+        for name in sorted(os.listdir(directory)):
+            if name.startswith(CHUNK_PREFIX):
+                path = os.path.join(directory, name)
+                self.chunks.append({column: np.load(os.path.join(path, f'{column}.npy'), mmap_mode='r')
+                                    for column in self.columns})
+        self.lengths = [len(chunk[self.columns[0]]) for chunk in self.chunks]
+
+    def __len__(self):
+        return sum(self.lengths)
+
+    def shape(self, column):
+        """Shape of one row of a column, or None for an empty dataset."""
+        return self.chunks[0][column].shape[1:] if self.chunks else None
+
+    def minibatches(self, batch_size, shuffle=True, seed=None, window_chunks=8):
+        """Yield every row once, in dicts of column -> array of batch_size rows (the last batch may be short).
+
+        Chunks are taken in random order window_chunks at a time, and the rows of each window shuffled, so only a
+        window is read into memory. Rows left over from one window are shuffled into the next.
+        """
+        rng = np.random.default_rng(seed)
+        order = rng.permutation(len(self.chunks)) if shuffle else np.arange(len(self.chunks))
+        carry = None
+        for start in range(0, len(order), window_chunks):
+            chunks = [self.chunks[i] for i in order[start:start + window_chunks]]
+            if carry is not None:
+                chunks.append(carry)
+            window = {column: np.concatenate([chunk[column] for chunk in chunks]) for column in self.columns}
+
+            rows = len(window[self.columns[0]])
+            index = rng.permutation(rows) if shuffle else np.arange(rows)
+            end = rows - rows % batch_size
+            for i in range(0, end, batch_size):
+                yield {column: values[index[i:i + batch_size]] for column, values in window.items()}
+            carry = {column: values[index[end:]] for column, values in window.items()} if end < rows else None
+
+        if carry is not None:
+            yield carry
@@ -0,0 +1,204 @@
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+from stable_baselines3.common.vec_env import VecEnv
+from stable_baselines3.common.vec_env.base_vec_env import CloudpickleWrapper
+
+
+class SharedArray:
+    """NumPy array backed by a named shared-memory block, so worker processes can attach to it by name."""
+
+    def __init__(self, shape, dtype, name=None):
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+        nbytes = max(1, int(np.prod(shape)) * self.dtype.itemsize)
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=nbytes)
+        self.array = np.ndarray(shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    def spec(self):
+        return self.shape, self.dtype.str, self.shm.name
+
+    @classmethod
+    def attach(cls, spec):
+        shape, dtype, name = spec
+        return cls(shape, dtype, name=name)
+
+    def close(self, unlink=False):
+        del self.array
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _worker(remote, parent_remote, env_fn_wrapper, start, stop, buffer_specs):
+    """Step envs [start, stop) on request. Observations, rewards and dones are written straight into the
+    shared buffers - only commands and the (usually empty) info dicts travel over the pipe."""
+    parent_remote.close()
+    envs = [env_fn_wrapper.var() for _ in range(start, stop)]
+    obs_buf, reward_buf, done_buf, action_buf = [SharedArray.attach(spec) for spec in buffer_specs]
+    obs, rewards, dones, actions = obs_buf.array, reward_buf.array, done_buf.array, action_buf.array
+
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'step':
+                infos = {}
+                for i, env in enumerate(envs, start):
+                    observation, reward, done, info = env.step(actions[i])
+                    if done:
+                        info['terminal_observation'] = observation
+                        observation = env.reset()
+                    obs[i] = observation
+                    rewards[i] = reward
+                    dones[i] = done
+                    if info:
+                        infos[i] = info
+                remote.send(infos)
+            elif cmd == 'reset':
+                for i, env in enumerate(envs, start):
+                    obs[i] = env.reset()
+                remote.send(None)
+            elif cmd == 'seed':
+                remote.send([env.seed(data + i) for i, env in enumerate(envs)])
+            elif cmd == 'get_attr':
+                name, indices = data
+                remote.send([getattr(envs[i - start], name) for i in indices])
+            elif cmd == 'set_attr':
+                name, value, indices = data
+                remote.send([setattr(envs[i - start], name, value) for i in indices])
+            elif cmd == 'env_method':
+                name, args, kwargs, indices = data
+                remote.send([getattr(envs[i - start], name)(*args, **kwargs) for i in indices])
+            elif cmd == 'is_wrapped':
+                wrapper_class, indices = data
+                remote.send([isinstance(envs[i - start], wrapper_class) for i in indices])
+            elif cmd == 'close':
+                for env in envs:
+                    env.close()
+                remote.close()
+                break
+            else:
+                raise NotImplementedError(f'`{cmd}` is not implemented in the worker')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for buf in (obs_buf, reward_buf, done_buf, action_buf):
+            buf.close()
+
+
+class SharedMemoryVecEnv(VecEnv):
+    """Runs n_envs environments across n_workers processes, each stepping its block of envs in turn.
+
+    Actions go to the workers and observations, rewards and dones come back through shared memory rather
+    than pickled pipe messages. env_fn must build one environment and be picklable (cloudpickle is used,
+    so lambdas and functools.partial both work).
+    """
+
+    def __init__(self, env_fn, n_envs, n_workers=None, start_method=None):
+        n_workers = min(n_workers or mp.cpu_count(), n_envs)
+        if start_method is None:
+            # forkserver is the safest choice with pygame/torch in the parent, but isn't available on Windows
+            start_method = 'forkserver' if 'forkserver' in mp.get_all_start_methods() else 'spawn'
+        ctx = mp.get_context(start_method)
+
+        # Probe one env in this process for the spaces
+        probe = env_fn()
+        observation_space, action_space = probe.observation_space, probe.action_space
+        probe.close()
+        super(SharedMemoryVecEnv, self).__init__(n_envs, observation_space, action_space)
+
+        self.obs_buf = SharedArray((n_envs,) + observation_space.shape, observation_space.dtype)
+        self.reward_buf = SharedArray((n_envs,), np.float32)
+        self.done_buf = SharedArray((n_envs,), bool)
+        self.action_buf = SharedArray((n_envs,) + action_space.shape, action_space.dtype)
+        buffer_specs = [buf.spec() for buf in (self.obs_buf, self.reward_buf, self.done_buf, self.action_buf)]
+
+        # Contiguous blocks of envs per worker
+        bounds = np.linspace(0, n_envs, n_workers + 1).astype(int)
+        self.blocks = list(zip(bounds[:-1], bounds[1:]))
+
+        self.remotes, work_remotes = zip(*[ctx.Pipe() for _ in range(n_workers)])
+        self.processes = []
+        for (start, stop), work_remote, remote in zip(self.blocks, work_remotes, self.remotes):
+            args = (work_remote, remote, CloudpickleWrapper(env_fn), start, stop, buffer_specs)
+            process = ctx.Process(target=_worker, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        self.waiting = False
+        self.closed = False
+
+    def reset(self):
+        for remote in self.remotes:
+            remote.send(('reset', None))
+        for remote in self.remotes:
+            remote.recv()
+        return self.obs_buf.array.copy()
+
+    def step_async(self, actions):
+        self.action_buf.array[:] = np.asarray(actions).reshape(self.action_buf.shape)
+        for remote in self.remotes:
+            remote.send(('step', None))
+        self.waiting = True
+
+    def step_wait(self):
+        infos = [{} for _ in range(self.num_envs)]
+        for remote in self.remotes:
+            for i, info in remote.recv().items():
+                infos[i] = info
+        self.waiting = False
+        return self.obs_buf.array.copy(), self.reward_buf.array.copy(), self.done_buf.array.copy(), infos
+
+    def seed(self, seed=None):
+        if seed is None:
+            seed = np.random.randint(0, 2 ** 31 - 1)
+        for remote, (start, _) in zip(self.remotes, self.blocks):
+            remote.send(('seed', seed + start))
+        return [s for remote in self.remotes for s in remote.recv()]
+
+    def close(self):
+        if self.closed:
+            return
+        if self.waiting:
+            for remote in self.remotes:
+                remote.recv()
+        for remote in self.remotes:
+            remote.send(('close', None))
+        for process in self.processes:
+            process.join()
+        for buf in (self.obs_buf, self.reward_buf, self.done_buf, self.action_buf):
+            buf.close(unlink=True)
+        self.closed = True
+
+    def get_attr(self, attr_name, indices=None):
+        return self._call_envs('get_attr', lambda i: (attr_name, i), indices)
+
+    def set_attr(self, attr_name, value, indices=None):
+        self._call_envs('set_attr', lambda i: (attr_name, value, i), indices)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return self._call_envs('env_method', lambda i: (method_name, method_args, method_kwargs, i), indices)
+
+    def get_images(self):
+        # stable-baselines3 1.x has no default that asks the envs for frames
+        return self.env_method('render', 'rgb_array')
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return self._call_envs('is_wrapped', lambda i: (wrapper_class, i), indices)
+
+    def _call_envs(self, cmd, make_data, indices):
+        """Send a command to the workers owning `indices` and gather the replies in index order."""
+        indices = list(self._get_indices(indices))
+        targets = []
+        for remote, (start, stop) in zip(self.remotes, self.blocks):
+            owned = [i for i in indices if start <= i < stop]
+            if owned:
+                remote.send((cmd, make_data(owned)))
+                targets.append((remote, owned))
+
+        results = {}
+        for remote, owned in targets:
+            results.update(zip(owned, remote.recv()))
+        return [results[i] for i in indices]
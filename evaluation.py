@@ -0,0 +1,80 @@
+from functools import partial
+from statistics import NormalDist
+
+import numpy as np
+
+from stable_baselines3.common.vec_env import DummyVecEnv
+
+from game_env import MyGameEnv
+from vec_game_env import MyGameVecEnv, batched_reward_engine
+from env_pool import SharedMemoryVecEnv
+
+EPISODE_STATS = ('return', 'length', 'score', 'level')
+
+
+def make_eval_env(reward_function=None, n_envs=32, n_workers=1, env_class=MyGameEnv):
+    """n_envs headless env_class games to evaluate on - in one process, or spread over n_workers processes.
+
+    MyGameEnv games whose reward has a batched form (see vec_game_env.batched_reward_engine) are played by the
+    equivalent batched MyGameVecEnv instead when there is one process.
+    """
+    if env_class is MyGameEnv and n_workers <= 1 and batched_reward_engine(reward_function) is not None:
+        return MyGameVecEnv(n_envs, reward_function=reward_function)
+
+    env_fn = partial(env_class, reward_function=reward_function, headless=True)
+    if n_workers <= 1:
+        return DummyVecEnv([env_fn] * n_envs)
+    return SharedMemoryVecEnv(env_fn, n_envs=n_envs, n_workers=n_workers)
+
+
+def describe_episodes(values, confidence=0.95):
+    """Distribution of a per-episode statistic, with a normal-approximation confidence interval of its mean."""
+    values = np.asarray(values, dtype=np.float64)
+    mean = values.mean()
+    half_width = 0.0
+    if len(values) > 1:
+        half_width = NormalDist().inv_cdf(0.5 + confidence / 2) * values.std(ddof=1) / np.sqrt(len(values))
+    p5, p50, p95 = np.percentile(values, [5, 50, 95])
+    return {'mean': float(mean), 'ci_low': float(mean - half_width), 'ci_high': float(mean + half_width),
+            'std': float(values.std()), 'min': float(values.min()), 'p5': float(p5), 'p50': float(p50),
+            'p95': float(p95), 'max': float(values.max()), 'values': values}
+
+
+def evaluate_policy(model, env, n_episodes=100, seed=None, deterministic=True, confidence=0.95):
+    """Play n_episodes across every sub-env of a VecEnv at once, calling the policy once per step on the whole
+    batch of observations.
+
+    Each sub-env plays a fixed share of the episodes, so short episodes don't crowd out long ones. With a
+    seed the games are repeatable, so every model is scored on the same games. Returns the return, length,
+    score and level distributions, keyed by those names.
+    """
+    if n_episodes < 1:
+        raise ValueError(f'n_episodes must be at least 1, got {n_episodes}')
+    n_envs = env.num_envs
+    if seed is not None:
+        env.seed(seed)
+
+    targets = np.array([(n_episodes + i) // n_envs for i in range(n_envs)])
+    finished = np.zeros(n_envs, dtype=np.int64)
+    returns = np.zeros(n_envs)
+    lengths = np.zeros(n_envs, dtype=np.int64)
+    episodes = {stat: [] for stat in EPISODE_STATS}
+
+    obs = env.reset()
+    while (finished < targets).any():
+        actions, _ = model.predict(obs, deterministic=deterministic)
+        obs, rewards, dones, infos = env.step(actions)
+        returns += rewards
+        lengths += 1
+
+        for i in np.flatnonzero(dones):
+            if finished[i] < targets[i]:
+                episodes['return'].append(returns[i])
+                episodes['length'].append(lengths[i])
+                episodes['score'].append(infos[i].get('score', np.nan))
+                episodes['level'].append(infos[i].get('level', np.nan))
+                finished[i] += 1
+            returns[i] = 0
+            lengths[i] = 0
+
+    return {stat: describe_episodes(values, confidence) for stat, values in episodes.items()}
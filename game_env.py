@@ -1,17 +1,50 @@
 import gym
 from gym import spaces
 import numpy as np
-from main import Game, WINDOW_SIZE, ACCELERATION, MAX_SPEED, DRIFT, MAX_BULLETS  # Import your game class here
+from main import Game, WINDOW_SIZE, MAX_BULLETS, PIXEL_OBS_SIZE, PIXEL_FRAME_STACK  # Import your game class here
+from input_pipeline import AgentSource
 import pygame
-import cv2
+import inspect
+import time
+from functools import partial
+from reward_engine import StepGeometry, RewardEngine, REWARD_V1, REWARD_V2, REWARD_TERMS
+from instrumentation import StepInstrumentation
+
+STEP_PHASES = ('input', 'update', 'obs', 'reward', 'render')
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)  # RGB to grayscale weights
+
+
+def state_observation(game):
+    """The 'state' observation of a main.Game - character, oldest MAX_BULLETS bullets and money."""
+    # Get the player's state
+    player_state = np.array([game.character.x, game.character.y, game.character.velocity_x,
+                             game.character.velocity_y], dtype=np.float32)
+
+    # Get the states of the oldest bullets (limit to MAX_BULLETS), zero-padded
+    bullet_x, bullet_y = game.bullet_manager.positions()
+    n_bullets = min(len(bullet_x), MAX_BULLETS)
+    bullets = np.zeros((MAX_BULLETS, 3), dtype=np.float32)  # Initialize with zeros as float32
+    bullets[:n_bullets, 0] = bullet_x[:n_bullets]
+    bullets[:n_bullets, 1] = bullet_y[:n_bullets]
+    bullets[:n_bullets, 2] = game.bullet_manager.bullet_speed  # velocity
+
+    # Get the money state
+    money_state = np.array([game.money.x, game.money.y, int(game.money.visible)], dtype=np.float32)
+
+    # Concatenate all parts into a single observation vector
+    return np.concatenate([player_state, bullets.flatten(), money_state])
 
 
 class MyGameEnv(gym.Env):
-    def __init__(self, reward_function=None):
+    def __init__(self, reward_function=None, headless=False, instrument=False, instrument_every=1000,
+                 obs_type='state', pixel_size=PIXEL_OBS_SIZE, frame_stack=PIXEL_FRAME_STACK, recorders=()):
         super(MyGameEnv, self).__init__()
 
-        # Initialize your game
-        self.game = Game()
+        # Initialize your game, steered by the agent's actions - headless games only draw when render() is
+        # called explicitly. Recorders (replay.EpisodeRecorder, dataset.TrajectoryWriter) log every episode.
+        self.headless = headless
+        self.agent_input = AgentSource()
+        self.game = Game(headless=headless, input_source=self.agent_input, recorders=recorders)
 
         # Define action space: 0 = Up, 1 = Down, 2 = Left, 3 = Right
         self.action_space = spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
@@ -24,13 +57,25 @@ class MyGameEnv(gym.Env):
         # Total observation space size
         self.obs_dim = player_state_dim + bullet_state_dim * MAX_BULLETS + money_state_dim
 
+        # Observations are either the game state vector ('state') or the last frame_stack grayscale frames
+        # ('pixels'), rendered every step and downsampled to pixel_size x pixel_size
+        if obs_type not in ('state', 'pixels'):
+            raise ValueError(f"Unknown obs_type '{obs_type}', expected 'state' or 'pixels'")
+        self.obs_type = obs_type
+        self.pixel_obs = obs_type == 'pixels'
+
         # Define observation space
-        self.observation_space = spaces.Box(
-            low=-1024,  # Assuming all values can theoretically be any real number
-            high=1024,  # The real range will depend on the specific game mechanics
-            shape=(self.obs_dim,),
-            dtype=np.float32
-        )
+        if self.pixel_obs:
+            self.observation_space = spaces.Box(low=0, high=255, shape=(pixel_size, pixel_size, frame_stack),
+                                                dtype=np.uint8)
+            self._init_frame_stack(pixel_size, frame_stack)
+        else:
+            self.observation_space = spaces.Box(
+                low=-1024,  # Assuming all values can theoretically be any real number
+                high=1024,  # The real range will depend on the specific game mechanics
+                shape=(self.obs_dim,),
+                dtype=np.float32
+            )
 
         # Track the agent's total reward
         self.total_reward = 0
@@ -42,271 +87,224 @@ class MyGameEnv(gym.Env):
         self.initial_health = self.game.character.health
 
         # Set the reward function, defaulting to _calculate_reward if not provided
-        self.reward_function = reward_function or self._calculate_reward
+        self.reward_function = self._bind_reward_function(reward_function)
 
-    def step(self, action, reward_function=None):
-        action = np.array(action)  # Ensure action is a NumPy array
+        # Per-step geometry shared by the reward terms (rebuilt lazily after each update)
+        self.geometry = None
 
-        # Convert action from [-1, 1] to joystick range [0, 1023]
-        joystick_x = int((action[0] + 1) * 511.5)  # Convert to [0, 1023]
-        joystick_y = int((action[1] + 1) * 511.5)  # Convert to [0, 1023]
+        # Optional per-phase timing and reward term breakdown, summarised in info every instrument_every steps
+        self.instrumentation = StepInstrumentation(STEP_PHASES, report_every=instrument_every) if instrument else None
+        self.reward_breakdown = {} if instrument else None
 
-        # Invert the joystick values to match your game logic
-        inverted_x = 1023 - joystick_x
-        inverted_y = 1023 - joystick_y
-
-        # Implement the velocity update logic similar to get_velocity method
-        dead_zone = 100
+    def step(self, action, reward_function=None):
+        instrumentation = self.instrumentation
+        if instrumentation:
+            t_start = time.perf_counter()
 
-        if inverted_x < (512 - dead_zone):
-            self.game.character.velocity_x -= ACCELERATION
-        elif inverted_x > (512 + dead_zone):
-            self.game.character.velocity_x += ACCELERATION
-        else:
-            self.game.character.velocity_x *= DRIFT
+        # The game samples the action as its input for this update (steering through the same joystick rule
+        # as human play)
+        self.agent_input.act(action)
 
-        if inverted_y < (512 - dead_zone):
-            self.game.character.velocity_y -= ACCELERATION
-        elif inverted_y > (512 + dead_zone):
-            self.game.character.velocity_y += ACCELERATION
-        else:
-            self.game.character.velocity_y *= DRIFT
+        if instrumentation:
+            t_input = time.perf_counter()
 
-        # Ensure the velocity is within the allowed range
-        self.game.character.velocity_x = max(-MAX_SPEED, min(MAX_SPEED, self.game.character.velocity_x))
-        self.game.character.velocity_y = max(-MAX_SPEED, min(MAX_SPEED, self.game.character.velocity_y))
+        self.game.update()
+        self.geometry = None
 
-        # Bridge between GameEnv and Game - game env calculates
-        self.game.update(velocity_x=self.game.character.velocity_x, velocity_y=self.game.character.velocity_y)
+        if instrumentation:
+            t_update = time.perf_counter()
 
         # Get the new state
         observation = self._get_obs()
 
-        # Calculate reward
+        if instrumentation:
+            t_obs = time.perf_counter()
+
+        # Calculate reward, then remember the health it was judged against
         if reward_function is None:
-            reward_function = self._calculate_reward  # Use default reward function
+            reward = self.reward_function()
+        else:
+            reward = self._bind_reward_function(reward_function)()
+        self.initial_health = self.game.character.health
 
-            # Calculate reward
-        reward = reward_function()
+        if instrumentation:
+            t_reward = time.perf_counter()
 
         # Check if the game is over
         done = self.game.character.health <= 0
 
-        # Return the step information
+        # Return the step information, with how far the episode got once it ends
         info = {}
+        if done:
+            info['score'] = self.game.score
+            info['level'] = self.game.level
+
+        # Render (headless environments only render on request) - pixel observations already drew this frame
+        if not self.headless:
+            if self.pixel_obs:
+                self.game.present()
+            else:
+                self.render('human')
 
-        # Render
-        self.render('human')
+        if instrumentation:
+            self._record_instrumentation(info, (t_start, t_input, t_update, t_obs, t_reward, time.perf_counter()))
 
         return observation, reward, done, info
 
+    def _record_instrumentation(self, info, stamps):
+        self.instrumentation.record_phases(stamps)
+
+        # Per-term contributions are only known when the reward comes from a RewardEngine
+        if self.reward_breakdown:
+            self.instrumentation.record_terms(self.reward_breakdown)
+            info['reward_terms'] = self.reward_breakdown
+            self.reward_breakdown = {}
+
+        summary = self.instrumentation.end_step()
+        if summary is not None:
+            info['instrumentation'] = summary
+
+    def seed(self, seed=None):
+        # Seeds the game's random number generator - takes effect from the next reset
+        self.game.rng.seed(None if seed is None else int(seed))
+        return [seed]
+
     def reset(self):
         # Reset the game to the initial state
         self.game.reset_game()
 
         # Reset the initial health
         self.initial_health = self.game.character.health
+        self.geometry = None
 
-        # Return the initial observation
+        # Return the initial observation, with every stacked frame showing the starting screen
+        if self.pixel_obs:
+            self.frame_count = 0
         return self._get_obs()
 
     def render(self, mode='human'):
-        # Render the game to the screen
+        # Render the game to the screen (an offscreen surface when headless)
         self.game.render()
-        pygame.display.flip()
 
-    def _get_obs(self):
-        # Get the player's state
-        player_state = np.array([self.game.character.x, self.game.character.y, self.game.character.velocity_x,
-                                 self.game.character.velocity_y], dtype=np.float32)
+        if mode == 'rgb_array':
+            return pygame.surfarray.array3d(self.game.screen).swapaxes(0, 1)
 
-        # Get the states of all bullets (limit to max_bullets)
-        bullets = np.zeros((MAX_BULLETS, 3), dtype=np.float32)  # Initialize with zeros as float32
-        for i, bullet in enumerate(self.game.bullet_manager.bullets[:MAX_BULLETS]):
-            if len(bullet) >= 3:
-                bullets[i] = np.array([bullet[0], bullet[1], bullet[2]], dtype=np.float32)  # x, y, velocity
+        if not self.headless:
+            self.game.present()
 
-        # Get the money state
-        money_state = np.array([self.game.money.x, self.game.money.y, int(self.game.money.visible)], dtype=np.float32)
+    def _get_obs(self):
+        if self.pixel_obs:
+            return self._get_pixel_obs()
+        return state_observation(self.game)
+
+    def _init_frame_stack(self, pixel_size, frame_stack):
+        # Screen pixel sampled for each output pixel (nearest neighbour, from the centre of each cell)
+        self.sample_xs = ((np.arange(pixel_size) + 0.5) * WINDOW_SIZE / pixel_size).astype(np.intp)[None, :]
+        self.sample_ys = self.sample_xs.T
+        self.frame_stack = frame_stack
+
+        # Each frame is written twice, at slots i and i + k, so the last k frames in order are always the
+        # contiguous window [i + 1, i + k + 1) - no rolling or reordering copies
+        self.frames = np.zeros((pixel_size, pixel_size, 2 * frame_stack), dtype=np.uint8)
+        self.gray = np.empty((pixel_size, pixel_size), dtype=np.float32)
+        self.frame_count = 0
+
+    def _get_pixel_obs(self):
+        self.game.render()
 
-        # Concatenate all parts into a single observation vector
-        obs = np.concatenate([player_state, bullets.flatten(), money_state])
+        # Gather just the sampled pixels from a view of the surface, then weight them into grayscale
+        pixels = pygame.surfarray.pixels3d(self.game.screen)  # (x, y, rgb) view, no copy
+        np.dot(pixels[self.sample_xs, self.sample_ys], LUMA, out=self.gray)
+        del pixels  # Unlock the surface for the next render
 
-        return obs
+        k = self.frame_stack
+        if self.frame_count == 0:
+            self.frames[:] = self.gray[:, :, None]
+        i = self.frame_count % k
+        self.frames[:, :, i] = self.frames[:, :, i + k] = self.gray
+        self.frame_count += 1
 
-    def _calculate_reward(self):
-        reward = 0
+        return self.frames[:, :, i + 1:i + k + 1].copy()
 
-        # Reward for collecting money
-        reward += self._reward_for_collecting_money()
+    def _calculate_reward(self):
+        """Reward function balancing money collection against bullet avoidance."""
+        return self._evaluate_reward(REWARD_V1)
 
-        # Penalty for getting hit by a bullet
-        reward += self._penalty_for_getting_hit()
+    def _calculate_rewards_v2(self):
+        """Reward function focused on bullet avoidance and survival."""
+        return self._evaluate_reward(REWARD_V2)
 
-        # Additional penalties and incentives
-        reward += self._penalty_for_line_of_fire()
-        reward += self._penalty_for_being_in_upper_half()
-        reward += self._penalty_for_loitering_near_edges()
-        reward += self._penalty_for_going_too_fast()
-        reward += self._reward_for_being_in_center()
-        # reward += self._reward_for_dodging_bullets()
-        reward += self._penalty_for_time_since_money_appeared()
-        reward += self._reward_for_proximity_to_money()
+    def _evaluate_reward(self, engine):
+        """Reward from a RewardEngine, evaluated over this step's geometry."""
+        return float(engine.evaluate(self._step_geometry(), self.reward_breakdown))
 
-        return reward
-
-    def _exploration_reward(self):
-        # Track positions visited and reward for new positions
-        position = (int(self.game.character.x // 50), int(self.game.character.y // 50))
-        if position not in self.visited_positions:
-            self.visited_positions.add(position)
-            return 5  # Reward for exploring a new area
-        return 0
+    def _step_geometry(self):
+        # Computed at most once per step and shared by every reward term
+        if self.geometry is None:
+            self.geometry = StepGeometry.from_game(self.game, self.initial_health)
+        return self.geometry
 
+    def _bind_reward_function(self, reward_function):
+        """Zero-argument callable computing this env's reward from a reward function spec: a MyGameEnv reward
+        method (bound or not), a RewardEngine, or a list of (term name, weight) pairs."""
+        if reward_function is None:
+            return self._calculate_reward
+        if isinstance(reward_function, (list, tuple)):
+            reward_function = RewardEngine(reward_function)
+        if isinstance(reward_function, RewardEngine):
+            return partial(self._evaluate_reward, reward_function)
+        if inspect.ismethod(reward_function):
+            return reward_function
+        return partial(reward_function, self)
+
+    # The individual reward terms, for reward functions built from them - each is a reward_engine term kernel
+    # evaluated over this step's geometry
     def _reward_for_collecting_money(self):
-        """Reward for collecting money. This should be the highest incentive."""
-        if self.game.collection_message_visible:
-            return 50  # High reward for collecting money
-        return 0
+        return self._reward_term('collecting_money')
 
     def _penalty_for_getting_hit(self):
-        """Penalty for getting hit by a bullet, with a larger penalty for the final hit."""
-        if self.game.character.health < self.initial_health:
-            if self.game.character.health <= 0:
-                return -100  # Large penalty for the final death blow
-            else:
-                self.initial_health = self.game.character.health
-                return -20  # Standard penalty for getting hit
-        return 0
+        return self._reward_term('getting_hit')
 
     def _penalty_for_line_of_fire(self):
-        """Penalty for being in the line of fire, scaled by proximity to the bullet."""
-        penalty = 0
-        for bullet in self.game.bullet_manager.bullets:
-            bullet_x, bullet_y = bullet[0], bullet[1]
-            if abs(bullet_x - self.game.character.x) < 50:  # Within a certain x-distance of the bullet
-                if bullet_y < self.game.character.y:  # Bullet is above and moving towards the character
-                    penalty -= 10  # Stronger penalty for being in the direct path
-                elif bullet_y > self.game.character.y and abs(bullet_y - self.game.character.y) < 100:
-                    penalty -= 5  # Lesser penalty if the bullet is already past but close
-        return penalty
+        return self._reward_term('line_of_fire')
 
     def _penalty_for_being_in_upper_half(self):
-        """Penalty for staying in the upper half of the screen, which is closer to the source of bullets."""
-        if self.game.character.y < WINDOW_SIZE / 2:
-            return -5  # Moderate penalty for staying in the upper half
-        return 0
+        return self._reward_term('upper_half')
 
     def _penalty_for_loitering_near_edges(self):
-        """Penalty for loitering near the edges of the screen."""
-        penalty = 0
-        edge_distance_threshold = 100  # Distance from the edge to be considered "loitering"
-        if (self.game.character.x < edge_distance_threshold or
-                self.game.character.x > WINDOW_SIZE - edge_distance_threshold or
-                self.game.character.y < edge_distance_threshold or
-                self.game.character.y > WINDOW_SIZE - edge_distance_threshold):
-            penalty -= 10  # Penalty for staying near the edges
-        return penalty
+        return self._reward_term('loitering_near_edges')
 
     def _penalty_for_going_too_fast(self):
-        """Penalty for moving too fast, which might indicate panic or less control."""
-        speed = np.sqrt(self.game.character.velocity_x ** 2 + self.game.character.velocity_y ** 2)
-        max_speed_threshold = MAX_SPEED * 0.8  # Adjust threshold as needed
-        if speed > max_speed_threshold:
-            return -5  # Penalty for going too fast
-        return 0
+        return self._reward_term('going_too_fast')
 
     def _reward_for_being_in_center(self):
-        """Small reward for staying near the center of the screen, encouraging exploration."""
-        center_x, center_y = WINDOW_SIZE // 2, WINDOW_SIZE // 2
-        distance_from_center = np.sqrt((self.game.character.x - center_x) ** 2 +
-                                       (self.game.character.y - center_y) ** 2)
-        max_distance_from_center = np.sqrt(center_x ** 2 + center_y ** 2)
-        return 10 * (1 - distance_from_center / max_distance_from_center)  # Scaled reward based on proximity to center
+        return self._reward_term('being_in_center')
 
     def _reward_for_dodging_bullets(self):
-        """Reward for successfully dodging bullets."""
-        reward = 0
-        for bullet in self.game.bullet_manager.bullets:
-            bullet_x, bullet_y = bullet[0], bullet[1]
-            if abs(bullet_x - self.game.character.x) < 50 and bullet_y > self.game.character.y:
-                if bullet_y > self.game.character.y + 100:  # Successfully dodged bullet
-                    reward += 5  # Small reward for dodging
-        return reward
+        return self._reward_term('dodging_bullets')
 
     def _penalty_for_time_since_money_appeared(self):
-        """Penalty for the time elapsed since the money appeared but hasn't been collected."""
-        if self.game.money.visible:
-            elapsed_time = (pygame.time.get_ticks() - self.game.money.appear_time) / 1000  # Convert to seconds
-            return -0.1 * elapsed_time  # Penalty increases over time
-        return 0
+        return self._reward_term('time_since_money_appeared')
 
     def _reward_for_proximity_to_money(self):
-        """Reward based on the proximity of the character to the money, scaled to be as important as avoiding bullets."""
-        # Calculate the Euclidean distance between the character and the money
-        distance = np.sqrt((self.game.character.x - self.game.money.x) ** 2 +
-                           (self.game.character.y - self.game.money.y) ** 2)
-
-        # Normalize the distance (assuming max distance is the diagonal of the screen)
-        max_distance = np.sqrt(WINDOW_SIZE ** 2 + WINDOW_SIZE ** 2)
-        normalized_distance = distance / max_distance  # Normalize to [0, 1]
-
-        # Invert and scale the distance to a reward in the range [0, 20]
-        reward = 20 * (1 - normalized_distance)
-
-        return reward
-
-    ### Reward v2 - only for dodging bullets
-
-    def _calculate_rewards_v2(self):
-        """Reward function focused on bullet avoidance and survival."""
-        reward = 0
-
-        # Apply penalties based on proximity to bullets
-        reward += self._penalty_for_proximity_to_bullets_v2()
-
-        # Apply a severe penalty for getting hit by a bullet
-        reward += self._penalty_for_getting_hit_by_bullet_v2()
-
-        # Reward for surviving longer
-        reward += self._reward_for_survival_v2()
-
-        return reward
+        return self._reward_term('proximity_to_money')
 
     def _penalty_for_proximity_to_bullets_v2(self):
-        """Penalty based on the proximity of the character to bullets, with stronger penalties for closer proximity."""
-        penalty = 0
-
-        # Loop through all bullets and calculate the penalty based on distance
-        for bullet in self.game.bullet_manager.bullets:
-            distance = np.sqrt((self.game.character.x - bullet[0]) ** 2 +
-                               (self.game.character.y - bullet[1]) ** 2)
-
-            # Normalize the distance (assuming max distance is the diagonal of the screen)
-            max_distance = np.sqrt(WINDOW_SIZE ** 2 + WINDOW_SIZE ** 2)
-            normalized_distance = distance / max_distance  # Normalize to [0, 1]
-
-            # Inverse the distance to create a stronger penalty for closer distances
-            proximity_penalty = -50 * (1 - normalized_distance)  # Scale the penalty as needed
-
-            penalty += proximity_penalty
-
-        return penalty
+        return self._reward_term('proximity_to_bullets_v2')
 
     def _penalty_for_getting_hit_by_bullet_v2(self):
-        """Severe penalty for actually getting hit by a bullet."""
-        if self.game.character.health < self.initial_health:
-            hit_penalty = -200  # Large penalty for getting hit by a bullet
-            self.initial_health = self.game.character.health  # Update for subsequent hits
-            return hit_penalty
-        return 0
+        return self._reward_term('getting_hit_by_bullet_v2')
 
     def _reward_for_survival_v2(self):
-        """Reward that increases with the agent's survival time."""
-        # Calculate the time survived (you can use the game’s internal clock or a simple counter)
-        time_survived = pygame.time.get_ticks() / 1000  # Time in seconds
+        return self._reward_term('survival_v2')
 
-        # Scale the reward by time; for example, reward increases by 10 points per second survived
-        survival_reward = 10 * time_survived
+    def _reward_term(self, name):
+        return float(REWARD_TERMS[name](self._step_geometry()))
 
-        return survival_reward
+    def _exploration_reward(self):
+        # Track positions visited and reward for new positions
+        position = (int(self.game.character.x // 50), int(self.game.character.y // 50))
+        if position not in self.visited_positions:
+            self.visited_positions.add(position)
+            return 5  # Reward for exploring a new area
+        return 0
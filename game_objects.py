@@ -1,10 +1,40 @@
+import copy
 import pygame
 import random
-import time
+from itertools import repeat
+import numpy as np
 from config import *
-from graphics_fx import character_image, bullet_image, money_image, gunshot_sound, gunshot_channel
+from assets import assets
+
+NO_BULLET = np.iinfo(np.int64).max  # sort key that puts empty bullet slots last
+
+
+def collides(x, y, other_x, other_y, other_width, other_height):
+    """Array form of Character.check_collision - the character's box at (x, y) against other boxes shrunk
+    by COLLISION_SENSITIVITY. Takes scalars or broadcastable NumPy arrays and truncates to whole pixels
+    like pygame.Rect does."""
+    left = np.trunc(x)
+    top = np.trunc(y)
+    other_left = np.trunc(other_x + other_width * (1 - COLLISION_SENSITIVITY) / 2)
+    other_top = np.trunc(other_y + other_height * (1 - COLLISION_SENSITIVITY) / 2)
+    width = int(other_width * COLLISION_SENSITIVITY)
+    height = int(other_height * COLLISION_SENSITIVITY)
+    return ((left < other_left + width) & (other_left < left + CHARACTER_WIDTH) &
+            (top < other_top + height) & (other_top < top + CHARACTER_HEIGHT))
+
+def get_state(obj, names):
+    """Copies of the named attributes of a game object, for its get_state()."""
+    return {name: copy.copy(getattr(obj, name)) for name in names}
+
+
+def set_state(obj, state):
+    for name, value in state.items():
+        setattr(obj, name, copy.copy(value))
+
 
 class Character:
+    STATE = ('x', 'y', 'prev_x', 'prev_y', 'velocity_x', 'velocity_y', 'health')
+
     def __init__(self):
         self.x = INITIAL_X
         self.y = INITIAL_Y
@@ -12,7 +42,12 @@ class Character:
         self.velocity_y = 0
         self.health = START_HEALTH
 
+        # Position before the last move, for drawing in between simulation steps
+        self.prev_x = self.x
+        self.prev_y = self.y
+
     def move(self, velocity_x, velocity_y):
+        self.prev_x, self.prev_y = self.x, self.y
         self.x += velocity_x * SENSITIVITY
         self.y += velocity_y * SENSITIVITY
 
@@ -20,8 +55,14 @@ class Character:
         self.x = max(0, min(WINDOW_SIZE - CHARACTER_WIDTH, self.x))
         self.y = max(0, min(WINDOW_SIZE - CHARACTER_HEIGHT, self.y))
 
-    def draw(self, screen):
-        screen.blit(character_image, (self.x, self.y))
+    def sprite(self, alpha=1.0):
+        # alpha is how far between the previous and current step to draw (1 draws the current position)
+        x = self.prev_x + (self.x - self.prev_x) * alpha
+        y = self.prev_y + (self.y - self.prev_y) * alpha
+        return assets.image('character'), (x, y)
+
+    def draw(self, screen, alpha=1.0):
+        return screen.blit(*self.sprite(alpha))
 
     def check_collision(self, other_x, other_y, other_width=None, other_height=None):
         if other_width is None:
@@ -37,83 +78,165 @@ class Character:
         )
         return character_rect.colliderect(other_rect)
 
-    def check_bullet_collision(self, bullets):
-        for bullet in bullets:
-            if self.check_collision(bullet[0], bullet[1], bullet_image.get_width(), bullet_image.get_height()):
-                gunshot_sound.play()
-                bullets.remove(bullet)
-                return True
+    def check_bullet_collision(self, bullet_manager):
+        hits = bullet_manager.active & collides(self.x, self.y, bullet_manager.x, bullet_manager.y,
+                                                BULLET_WIDTH, BULLET_HEIGHT)
+        if not hits.any():
+            return False
 
-        return False
+        # One hit per frame - the oldest bullet that hit is removed
+        bullet_manager.active[np.where(hits, bullet_manager.seq, NO_BULLET).argmin()] = False
+        return True
 
     def reset_position(self):
         self.x = INITIAL_X  # Set this to the initial X position
         self.y = INITIAL_Y  # Set this to the initial Y position
+        self.velocity_x = 0
+        self.velocity_y = 0
+        self.prev_x, self.prev_y = self.x, self.y
+
+    def get_state(self):
+        return get_state(self, self.STATE)
+
+    def set_state(self, state):
+        set_state(self, state)
 
 class BulletManager:
-    def __init__(self):
-        self.bullets = []
-        self.last_bullet_time = time.time()
+    STATE = ('capacity', 'x', 'y', 'active', 'seq', 'next_seq', 'bullet_interval_min', 'bullet_interval_max', 'bullet_speed',
+             'max_bullets', 'next_bullet_interval', 'spawn_due')
+
+    def __init__(self, clock, capacity=BULLET_CAPACITY, rng=random):
+        # Bullets live in preallocated slots - x, y, whether the slot is in use and the spawn order (doubled if a
+        # level allows more bullets than there are slots)
+        self.initial_capacity = capacity
+        self.clear_slots()
+
+        self.clock = clock
+        self.rng = rng  # random.Random (or the random module) the game's randomness is drawn from
         self.bullet_interval_min = BULLET_INTERVAL_MIN
         self.bullet_interval_max = BULLET_INTERVAL_MAX
         self.bullet_speed = BULLET_SPEED
         self.max_bullets = MAX_BULLETS
-        self.next_bullet_interval = random.uniform(BULLET_INTERVAL_MIN, BULLET_INTERVAL_MAX)
+        self.next_bullet_interval = self.rng.uniform(BULLET_INTERVAL_MIN, BULLET_INTERVAL_MAX)
+        self.spawn_due = False
+        self.clock.schedule(BULLET_SPAWN_TIMER, self.next_bullet_interval)
 
     def update(self, bullet_speed, max_bullets, bullet_interval_max):
-        # Move bullets
-        for bullet in self.bullets:
-            bullet[1] += bullet_speed
-        self.bullets = [bullet for bullet in self.bullets if bullet[1] <= WINDOW_SIZE]
-
-        # Dynamically adjust bullet interval based on active bullets and speed
-        if len(self.bullets) < max_bullets:
-            if time.time() - self.last_bullet_time > self.next_bullet_interval:
-                self.spawn_bullet()
-                self.last_bullet_time = time.time()
-                if bullet_interval_max < self.bullet_interval_min:
-                    temp = bullet_interval_max
-                    bullet_interval_max = self.bullet_interval_min
-                    self.bullet_interval_min = temp
-
-                self.next_bullet_interval = random.uniform(self.bullet_interval_min, bullet_interval_max)
+        # Move bullets (empty slots move too - cheaper than masking) and cull the ones that left the screen
+        self.bullet_speed = bullet_speed
+        self.y += bullet_speed
+        self.active &= self.y <= WINDOW_SIZE
+
+        # Spawn once the spawn timer has fired and there is room for another bullet
+        if self.spawn_due and self.count() < max_bullets:
+            if self.count() == self.capacity:
+                self.grow()
+            self.spawn_bullet()
+            self.spawn_due = False
+            if bullet_interval_max < self.bullet_interval_min:
+                temp = bullet_interval_max
+                bullet_interval_max = self.bullet_interval_min
+                self.bullet_interval_min = temp
+
+            self.next_bullet_interval = self.rng.uniform(self.bullet_interval_min, bullet_interval_max)
+            self.clock.schedule(BULLET_SPAWN_TIMER, self.next_bullet_interval)
+
+    def grow(self):
+        """Double the bullet slots - for levels allowing more bullets than were preallocated."""
+        added = self.capacity
+        self.x = np.concatenate([self.x, np.zeros(added)])
+        self.y = np.concatenate([self.y, np.zeros(added)])
+        self.active = np.concatenate([self.active, np.zeros(added, dtype=bool)])
+        self.seq = np.concatenate([self.seq, np.zeros(added, dtype=np.int64)])
+        self.capacity += added
+
+    def clear_slots(self):
+        # Empty bullet slots, as many as a new game starts with
+        self.capacity = self.initial_capacity
+        self.x = np.zeros(self.capacity)
+        self.y = np.zeros(self.capacity)
+        self.active = np.zeros(self.capacity, dtype=bool)
+        self.seq = np.zeros(self.capacity, dtype=np.int64)
+        self.next_seq = 0
 
     def spawn_bullet(self):
-        bullet_x = random.randint(0, WINDOW_SIZE - bullet_image.get_width())
-        bullet_y = 0
-        self.bullets.append([bullet_x, bullet_y])
-
-    def draw(self, screen):
-        for bullet in self.bullets:
-            screen.blit(bullet_image, (bullet[0], bullet[1]))
+        slot = self.active.argmin()  # first free slot
+        self.x[slot] = self.rng.randint(0, WINDOW_SIZE - BULLET_WIDTH)
+        self.y[slot] = 0
+        self.active[slot] = True
+        self.seq[slot] = self.next_seq
+        self.next_seq += 1
+
+    def count(self):
+        return np.count_nonzero(self.active)
+
+    def positions(self):
+        """x and y arrays of the active bullets, oldest first."""
+        slots = np.flatnonzero(self.active)
+        slots = slots[np.argsort(self.seq[slots])]
+        return self.x[slots], self.y[slots]
+
+    def sprites(self, alpha=1.0):
+        """(surface, position) pairs of the active bullets, oldest first, for Surface.blits."""
+        x, y = self.positions()
+        # Bullets fall bullet_speed per step, so in between steps they are that much less the way down
+        y = y - (1 - alpha) * self.bullet_speed
+        return list(zip(repeat(assets.image('bullet')), zip(x.tolist(), y.tolist())))
+
+    def draw(self, screen, alpha=1.0):
+        return screen.blits(self.sprites(alpha))
 
     def reset(self):
-        self.bullets.clear()  # Remove all active bullets
+        # Remove all bullets, clearing their slots too so a reset game is in exactly the state of a new one
+        self.clear_slots()
+        self.bullet_speed = BULLET_SPEED
+
+        # Re-arm the spawn timer with a fresh interval (the clock is reset along with the game), so a seeded
+        # reset always starts the same game
+        self.spawn_due = False
+        self.bullet_interval_min = BULLET_INTERVAL_MIN
+        self.next_bullet_interval = self.rng.uniform(BULLET_INTERVAL_MIN, BULLET_INTERVAL_MAX)
+        self.clock.schedule(BULLET_SPAWN_TIMER, self.next_bullet_interval)
+
+    def get_state(self):
+        return get_state(self, self.STATE)
+
+    def set_state(self, state):
+        set_state(self, state)
 
 class Money:
-    def __init__(self):
-        self.appear_time = pygame.time.get_ticks()
-        self.x = random.randint(0, WINDOW_SIZE - money_image.get_width())
-        self.y = random.randint(0, WINDOW_SIZE - money_image.get_height())
+    STATE = ('appear_time', 'x', 'y', 'visible', 'respawn_delay')
+
+    def __init__(self, clock, rng=random):
+        self.clock = clock
+        self.rng = rng
+        self.appear_time = clock.time
+        self.x = self.rng.randint(0, WINDOW_SIZE - MONEY_WIDTH)
+        self.y = self.rng.randint(0, WINDOW_SIZE - MONEY_HEIGHT)
         self.visible = True
-        self.respawn_delay = random.uniform(RESPAWN_DELAY_MIN, RESPAWN_DELAY_MAX)
-        self.disappear_time = pygame.time.get_ticks()
+        self.respawn_delay = self.rng.uniform(RESPAWN_DELAY_MIN, RESPAWN_DELAY_MAX)
+
+    def sprite(self):
+        return assets.image('money'), (self.x, self.y)
 
     def draw(self, screen):
         if self.visible:
-            screen.blit(money_image, (self.x, self.y))
+            return screen.blit(*self.sprite())
 
     def collect(self):
         self.visible = False
-        self.disappear_time = time.time()
-        return random.choice([5, 20, 100])
+        self.clock.schedule(MONEY_RESPAWN_TIMER, self.respawn_delay)
+        return self.rng.choice([5, 20, 100])
 
     def respawn(self):
-        if not self.visible and (time.time() - self.disappear_time > self.respawn_delay):
-            self.x = random.randint(0, WINDOW_SIZE - money_image.get_width())
-            self.y = random.randint(0, WINDOW_SIZE - money_image.get_height())
-            self.visible = True  # Ensure visibility is set to True here
-            self.appear_time = pygame.time.get_ticks()
-            self.respawn_delay = random.uniform(RESPAWN_DELAY_MIN, RESPAWN_DELAY_MAX)
+        self.x = self.rng.randint(0, WINDOW_SIZE - MONEY_WIDTH)
+        self.y = self.rng.randint(0, WINDOW_SIZE - MONEY_HEIGHT)
+        self.visible = True  # Ensure visibility is set to True here
+        self.appear_time = self.clock.time
+        self.respawn_delay = self.rng.uniform(RESPAWN_DELAY_MIN, RESPAWN_DELAY_MAX)
 
+    def get_state(self):
+        return get_state(self, self.STATE)
 
+    def set_state(self, state):
+        set_state(self, state)
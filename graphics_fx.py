@@ -1,65 +1,127 @@
 import pygame
+from collections import OrderedDict
 from config import *
+from profiler import profiler
+from assets import assets
 
-# Load sounds
-gunshot_sound = pygame.mixer.Sound('sounds/gunshot.mp3')
-gunshot_channel = pygame.mixer.Channel(0)
-gunshot_sound.set_volume(0.1)
-background_music = pygame.mixer.Sound('sounds/background.mp3')
-background_channel = pygame.mixer.Channel(1)
-background_music.set_volume(0.1)
-cash_sound = pygame.mixer.Sound('sounds/cash.mp3')
-cash_channel = pygame.mixer.Channel(2)
-cash_sound.set_volume(0.4)
-
-# Load images
-character_image = pygame.image.load('images/50.png')
-bullet_image = pygame.image.load('images/bullet.png')
-money_image = pygame.image.load('images/money.png')
-bank_image = pygame.image.load('images/bank.png')
-background_image = pygame.image.load('images/background.jpg')
-end_image = pygame.image.load('images/end.png')
-heart_image = pygame.image.load('images/heart.png')
-
-# Scale images
-character_image = pygame.transform.scale(character_image, (CHARACTER_WIDTH, CHARACTER_HEIGHT))
-bullet_image = pygame.transform.scale(pygame.transform.flip(bullet_image, False, True), (bullet_image.get_width() // 5, bullet_image.get_height() // 5))
-money_image = pygame.transform.scale(money_image, (money_image.get_width() // 5, money_image.get_height() // 5))
-bank_image = pygame.transform.scale(bank_image, (BANK_SIZE, BANK_SIZE))
-background_image = pygame.transform.scale(background_image, (TILE_WIDTH, TILE_HEIGHT))
-heart_image = pygame.transform.scale(heart_image, (50, 50))
-end_image = pygame.transform.scale(end_image, (300, 380))
-
-def draw_tiled_background(screen, offset_y):
-    screen.blit(background_image, (0, offset_y))
-    screen.blit(background_image, (0, offset_y + TILE_HEIGHT))
-    if offset_y > 0:
-        screen.blit(background_image, (0, offset_y - TILE_HEIGHT))
+# Fonts by (face, size), and rendered text surfaces by (text, size, colour, face) - least recently used first
+fonts = {}
+text_cache = OrderedDict()
 
-def draw_chessboard(screen, offset):
+
+def get_font(size, face=None):
+    key = (face, size)
+    font = fonts.get(key)
+    if font is None:
+        font = fonts[key] = pygame.font.Font(face, size)
+    return font
+
+
+def render_text(text, size, colour, face=None):
+    """Antialiased text surface, rendered once and then served from a bounded LRU cache."""
+    key = (text, size, colour, face)
+    surface = text_cache.get(key)
+    if surface is None:
+        with profiler.phase('text'):
+            surface = text_cache[key] = get_font(size, face).render(text, True, colour)
+        if len(text_cache) > TEXT_CACHE_SIZE:
+            text_cache.popitem(last=False)
+    else:
+        text_cache.move_to_end(key)
+    return surface
+
+# Layers that never change, pre-rendered on first use in the pixel format of the screen they are drawn to (so
+# drawing them is a straight copy)
+static_layers = {}
+
+
+def get_static_layer(name, screen, size, draw):
+    key = (name, screen.get_bitsize(), screen.get_masks())
+    layer = static_layers.get(key)
+    if layer is None:
+        layer = static_layers[key] = pygame.Surface(size, 0, screen)
+        draw(layer)
+    return layer
+
+
+def draw_background_strip(strip):
+    # The background tile stacked three high - any scroll offset of the tiled background is a window of it
+    tile = assets.image('background')
+    for i in range(3):
+        strip.blit(tile, (0, i * TILE_HEIGHT))
+
+
+def draw_tiled_background(screen, offset_y, rect=None):
+    """Draw the background scrolled down by offset_y (in [0, TILE_HEIGHT)) with one blit - into just rect of the
+    screen if given. The background is opaque, so nothing needs clearing first."""
+    if rect is None:
+        rect = screen.get_rect()
+    else:
+        rect = pygame.Rect(rect)
+    strip = get_static_layer('background', screen, (TILE_WIDTH, 3 * TILE_HEIGHT), draw_background_strip)
+    return screen.blit(strip, rect, rect.move(0, TILE_HEIGHT - int(offset_y)))
+
+
+def draw_chessboard_squares(board):
     for row in range(BOARD_SIZE):
         for col in range(BOARD_SIZE):
             color = RED if (row + col) % 2 == 0 else PINK
-            pygame.draw.rect(screen, color, (col * SQUARE_SIZE, (row * SQUARE_SIZE) + offset, SQUARE_SIZE, SQUARE_SIZE))
+            pygame.draw.rect(board, color, (col * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
+
+
+def draw_chessboard(screen, offset):
+    board = get_static_layer('chessboard', screen, (BOARD_SIZE * SQUARE_SIZE, BOARD_SIZE * SQUARE_SIZE),
+                             draw_chessboard_squares)
+    return screen.blit(board, (0, offset))
+
+
+def filled_surface(size, colour):
+    surface = pygame.Surface(size, pygame.SRCALPHA)
+    surface.fill(colour)
+    return surface
+
+
+class CachedLayer:
+    """Sprites that rarely change, pre-composited into one transparent surface.
+
+    compose(*state) returns the (surface, position) pairs to draw for a state. They are only composed again
+    when the state changes - every frame in between is a single blit. Sprites blitted onto the layer's
+    transparent pixels keep their own alpha, so the layer blends over the screen as they would one by one.
+    """
+
+    def __init__(self, compose):
+        self.compose = compose
+        self.state = None
+        self.surface = None
+        self.position = None
+
+    def draw(self, screen, *state):
+        if self.surface is None or state != self.state:
+            self.state = state
+            items = self.compose(*state)
+            rects = [surface.get_rect(topleft=position) for surface, position in items]
+            bounds = rects[0].unionall(rects[1:])
+            self.surface = pygame.Surface(bounds.size, pygame.SRCALPHA)
+            for (surface, _), rect in zip(items, rects):
+                self.surface.blit(surface, rect.move(-bounds.x, -bounds.y))
+            self.position = bounds.topleft
+        return screen.blit(self.surface, self.position)
+
 
 def draw_character(screen, character_x, character_y):
-    screen.blit(character_image, (character_x, character_y))
+    return screen.blit(assets.image('character'), (character_x, character_y))
 
 def draw_money(screen, money_x, money_y):
-    screen.blit(money_image, (money_x, money_y))
+    return screen.blit(assets.image('money'), (money_x, money_y))
 
 def draw_collection_message(screen, message_visible, collection_message, money_x, money_y):
     if message_visible:
-        font = pygame.font.Font(None, 36)
-        message_text = font.render(collection_message, True, (255, 255, 0))
-        screen.blit(message_text, (money_x, money_y - 40))
+        message_text = render_text(collection_message, 36, (255, 255, 0))
+        return screen.blit(message_text, (money_x, money_y - 40))
 
-def draw_score(screen, score, bank_x, bank_y):
-    font = pygame.font.Font(None, 36)
-    score_text = font.render(f"Score: ${score}", True, (255, 255, 255))
+def compose_score(score, bank_x, bank_y):
+    """The bank with the score under it, as (surface, position) pairs for a CachedLayer."""
+    score_text = render_text(f"Score: ${score}", 36, (255, 255, 255))
     score_x = bank_x + (BANK_SIZE - score_text.get_width()) // 2
     score_y = bank_y + BANK_SIZE + 5
-    screen.blit(score_text, (score_x, score_y))
-
-def draw_bank(screen, bank_x, bank_y):
-    screen.blit(bank_image, (bank_x, bank_y))
+    return [(assets.image('bank'), (bank_x, bank_y)), (score_text, (score_x, score_y))]
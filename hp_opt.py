@@ -1,12 +1,60 @@
+import multiprocessing as mp
 import optuna
+from optuna.storages import RDBStorage, RetryFailedTrialCallback
+from optuna.study import MaxTrialsCallback
+from optuna.trial import TrialState
 import torch as th
-import numpy as np
 from game_env import MyGameEnv
 from stable_baselines3 import PPO
 from PPO import PerformanceLoggerCallback
+from evaluation import make_eval_env, evaluate_policy
+
+# Trials finished (or stopped early) count towards n_trials - failed ones are retried
+FINISHED_STATES = (TrialState.COMPLETE, TrialState.PRUNED)
+
+# Pruners by name, built from the number of evaluation checkpoints in a full trial (the budget is measured in
+# checkpoints, so a trial stopped at checkpoint k has used k / n_evaluations of total_timesteps)
+PRUNERS = {
+    'hyperband': lambda n_evaluations: optuna.pruners.HyperbandPruner(min_resource=1, max_resource=n_evaluations,
+                                                                      reduction_factor=3),
+    'halving': lambda n_evaluations: optuna.pruners.SuccessiveHalvingPruner(min_resource=1, reduction_factor=3),
+    'median': lambda n_evaluations: optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=1),
+    None: lambda n_evaluations: optuna.pruners.NopPruner(),
+}
+
+
+class TrialEvalCallback(PerformanceLoggerCallback):
+    """Logs training performance like PerformanceLoggerCallback, and every eval_every timesteps evaluates the
+    model, reports the score to the trial and stops training if the pruner says the trial is hopeless."""
+
+    def __init__(self, trial, params, evaluate, eval_every, save_dir='plots', verbose=0):
+        super(TrialEvalCallback, self).__init__(trial.number, params, save_dir=save_dir, verbose=verbose)
+        self.trial = trial
+        self.evaluate = evaluate
+        self.eval_every = eval_every
+        self.n_evaluations = 0
+        self.last_score = None
+        self.pruned = False
+
+    def _on_step(self) -> bool:
+        super(TrialEvalCallback, self)._on_step()
+
+        if self.num_timesteps < (self.n_evaluations + 1) * self.eval_every:
+            return True
+
+        self.n_evaluations += 1
+        self.last_score = self.evaluate(self.model)
+        self.trial.report(self.last_score, self.n_evaluations)
+
+        # Returning False ends model.learn early
+        self.pruned = self.trial.should_prune()
+        return not self.pruned
+
 
 class HyperparameterOptimizer:
-    def __init__(self, model_str, env_class, reward_function, hyperparams, total_timesteps=10000, n_trials=20):
+    def __init__(self, model_str, env_class, reward_function, hyperparams, total_timesteps=10000, n_trials=20,
+                 n_jobs=1, storage='sqlite:///hp_opt.db', study_name=None, pruner='hyperband', n_evaluations=9,
+                 eval_episodes=16, final_eval_episodes=64, eval_envs=16, eval_seed=0):
         """
         Initializes the optimizer.
 
@@ -17,6 +65,17 @@ class HyperparameterOptimizer:
                             Example: {"ent_coef": (0.0001, 0.1), "learning_rate": (1e-5, 0.01)}
         :param total_timesteps: Number of timesteps to train during each trial.
         :param n_trials: Number of trials for the optimization.
+        :param n_jobs: Number of worker processes running trials concurrently, each with its own environment.
+        :param storage: Database URL of the study - a local SQLite file by default, so a crashed or
+                        interrupted search resumes where it stopped.
+        :param study_name: Name of the study in the storage, defaulting to '<model_str>-<reward function>'.
+        :param pruner: How trials are stopped early from their intermediate scores - 'hyperband', 'halving'
+                       (successive halving), 'median' or None to train every trial for the full budget.
+        :param n_evaluations: Number of evaluation checkpoints during a trial's training.
+        :param eval_episodes: Episodes played at each intermediate checkpoint.
+        :param final_eval_episodes: Episodes played to score the fully trained model.
+        :param eval_envs: Games played at once during evaluation, with the policy called on all of them per step.
+        :param eval_seed: Seed of the evaluation games - every trial is scored on the same games.
         """
         self.model_str = model_str
         self.env_class = env_class
@@ -24,6 +83,16 @@ class HyperparameterOptimizer:
         self.hyperparams = hyperparams
         self.total_timesteps = total_timesteps
         self.n_trials = n_trials
+        self.n_jobs = n_jobs
+        self.storage = storage
+        self.study_name = study_name or f'{model_str}-{getattr(reward_function, "__name__", "reward")}'
+        self.pruner = pruner
+        self.n_evaluations = n_evaluations
+        self.eval_episodes = eval_episodes
+        self.final_eval_episodes = final_eval_episodes
+        self.eval_envs = eval_envs
+        self.eval_seed = eval_seed
+        self.last_evaluation = None
 
     def objective(self, trial):
         # Suggest hyperparameters
@@ -34,8 +103,8 @@ class HyperparameterOptimizer:
             else:
                 hyperparams[param_name] = trial.suggest_float(param_name, low, high, log=True)
 
-        # Initialize the environment
-        env = self.env_class(reward_function=self.reward_function)
+        # Initialize the environment (trials never need a window)
+        env = self.env_class(reward_function=self.reward_function, headless=True)
 
         # Initialize the model with suggested hyperparameters
         model = PPO(
@@ -46,8 +115,15 @@ class HyperparameterOptimizer:
             **hyperparams
         )
 
-        # Initialize the performance logger callback
-        performance_logger = PerformanceLoggerCallback(trial.number, hyperparams)
+        # Initialize the performance logger callback, which also scores the model at each checkpoint on its
+        # own batch of games of the same env class (evaluating on the training env would disturb the rollout in
+        # progress)
+        eval_env = make_eval_env(self.reward_function, n_envs=self.eval_envs, env_class=self.env_class)
+        performance_logger = TrialEvalCallback(
+            trial, hyperparams,
+            evaluate=lambda model: self.evaluate_model(model, eval_env, n_episodes=self.eval_episodes),
+            eval_every=max(1, self.total_timesteps // self.n_evaluations),
+        )
 
         # Train the model
         model.learn(total_timesteps=self.total_timesteps, callback=performance_logger)
@@ -55,32 +131,76 @@ class HyperparameterOptimizer:
         # Save the plots for this trial
         performance_logger.save_results()
 
+        if performance_logger.pruned:
+            env.close()
+            eval_env.close()
+            raise optuna.TrialPruned(f'Pruned at checkpoint {performance_logger.n_evaluations} '
+                                     f'with score {performance_logger.last_score}')
+
         # Evaluate the model
-        mean_reward = self.evaluate_model(model, env)
+        mean_reward = self.evaluate_model(model, eval_env, n_episodes=self.final_eval_episodes)
+        eval_env.close()
+
+        # Keep the spread of the final evaluation alongside its mean
+        for stat, summary in self.last_evaluation.items():
+            for name in ('mean', 'ci_low', 'ci_high'):
+                trial.set_user_attr(f'{stat}_{name}', summary[name])
 
         return mean_reward
 
     def evaluate_model(self, model, env, n_episodes=5):
-        """Evaluate the model performance over a number of episodes."""
-        all_rewards = []
-        for _ in range(n_episodes):
-            obs = env.reset()
-            done = False
-            total_reward = 0
-            while not done:
-                action, _ = model.predict(obs)
-                obs, reward, done, info = env.step(action)
-                total_reward += reward
-            all_rewards.append(total_reward)
-        return np.mean(all_rewards)
+        """Mean episode return over n_episodes, played concurrently on the sub-envs of a VecEnv. The full
+        return/length/score/level distributions are kept in last_evaluation."""
+        self.last_evaluation = evaluate_policy(model, env, n_episodes=n_episodes, seed=self.eval_seed)
+        return self.last_evaluation['return']['mean']
+
+    def load_study(self):
+        """Create the study in the storage, or load it if it already exists."""
+        storage = RDBStorage(
+            self.storage,
+            # Trials whose process died stop sending heartbeats, and are failed and retried once
+            heartbeat_interval=60,
+            grace_period=180,
+            failed_trial_callback=RetryFailedTrialCallback(max_retry=1),
+            # Wait for other workers' writes rather than failing on a locked SQLite file
+            engine_kwargs={'connect_args': {'timeout': 60}} if self.storage.startswith('sqlite') else None,
+        )
+        return optuna.create_study(study_name=self.study_name, storage=storage, direction="maximize",
+                                   pruner=PRUNERS[self.pruner](self.n_evaluations), load_if_exists=True)
+
+    def finished_trials(self, study):
+        return len(study.get_trials(deepcopy=False, states=FINISHED_STATES))
+
+    def run_trials(self, torch_threads=None):
+        """Run trials from this process until the study has n_trials finished trials."""
+        if torch_threads:
+            th.set_num_threads(torch_threads)
+
+        study = self.load_study()
+        if self.finished_trials(study) >= self.n_trials:
+            return
+        study.optimize(self.objective, callbacks=[MaxTrialsCallback(self.n_trials, states=FINISHED_STATES)])
 
     def optimize(self):
-        """Optimize the hyperparameters using optuna."""
-        study = optuna.create_study(direction="maximize")
-        study.optimize(self.objective, n_trials=self.n_trials)
+        """Optimize the hyperparameters using optuna, running trials in n_jobs worker processes that share
+        the study storage."""
+        study = self.load_study()
+        print(f"Study '{self.study_name}': {self.finished_trials(study)}/{self.n_trials} trials finished")
+
+        if self.n_jobs <= 1:
+            self.run_trials()
+        else:
+            # Split the cores between workers so their torch thread pools don't oversubscribe the box
+            torch_threads = max(1, mp.cpu_count() // self.n_jobs)
+            ctx = mp.get_context('forkserver' if 'forkserver' in mp.get_all_start_methods() else 'spawn')
+            workers = [ctx.Process(target=self.run_trials, args=(torch_threads,)) for _ in range(self.n_jobs)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
 
         # Get the best trial
-        best_trial = study.best_trial
+        best_trial = self.load_study().best_trial
         print(f"Best trial: Value: {best_trial.value}, Params: {best_trial.params}")
 
         return best_trial.params
@@ -98,7 +218,8 @@ def train_with_optimized_hyperparameters(model_name):
             "clip_range": (0.1, 0.4)
         },
         total_timesteps=10000,
-        n_trials=100
+        n_trials=100,
+        n_jobs=mp.cpu_count()
     )
 
     best_hyperparams = optimizer.optimize()
@@ -117,4 +238,5 @@ def train_with_optimized_hyperparameters(model_name):
     model.save(model_name)
 
 
-train_with_optimized_hyperparameters('hp-optimised-bullet-dodger')
+if __name__ == '__main__':
+    train_with_optimized_hyperparameters('hp-optimised-bullet-dodger')
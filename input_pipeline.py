@@ -0,0 +1,118 @@
+import time
+
+import numpy as np
+import pygame
+from config import *
+
+# Joystick readings run from 0 to 1023 - the centre, and the ends a keyboard press maps to
+JOYSTICK_CENTER = 512
+JOYSTICK_MAX = 1023
+
+
+class InputSnapshot:
+    """One tick's input: x and y joystick readings in [0, 1023], the switch (0 while pressed), and the
+    perf_counter() time the sample arrived (None when there is no device behind it)."""
+
+    __slots__ = ('x', 'y', 'switch', 'sample_time')
+
+    def __init__(self, x=JOYSTICK_CENTER, y=JOYSTICK_CENTER, switch=1, sample_time=None):
+        self.x = x
+        self.y = y
+        self.switch = switch
+        self.sample_time = sample_time
+
+
+def integrate_velocity(velocity, reading):
+    """Velocity after one tick of a joystick axis reading: accelerate when the (inverted) reading is outside
+    the dead zone, drift towards rest inside it, and cap at MAX_SPEED."""
+    inverted = JOYSTICK_MAX - reading
+    if inverted < JOYSTICK_CENTER - DEAD_ZONE:
+        velocity -= ACCELERATION
+    elif inverted > JOYSTICK_CENTER + DEAD_ZONE:
+        velocity += ACCELERATION
+    else:
+        velocity *= DRIFT
+    return max(-MAX_SPEED, min(MAX_SPEED, velocity))
+
+
+def integrate_velocities(velocity, reading):
+    """integrate_velocity for arrays of velocities and readings (one per game)."""
+    inverted = JOYSTICK_MAX - reading
+    velocity = np.where(inverted < JOYSTICK_CENTER - DEAD_ZONE, velocity - ACCELERATION,
+                        np.where(inverted > JOYSTICK_CENTER + DEAD_ZONE, velocity + ACCELERATION, velocity * DRIFT))
+    return np.clip(velocity, -MAX_SPEED, MAX_SPEED)
+
+
+def action_to_reading(value):
+    """Joystick reading for one component of an agent's action in [-1, 1]."""
+    return int((value + 1) * 511.5)
+
+
+def reading_to_action(reading):
+    """Agent action component in [-1, 1] for a joystick reading - the inverse of action_to_reading."""
+    return reading / 511.5 - 1
+
+
+class KeyboardSource:
+    """Arrow keys as a joystick pushed all the way, and the left mouse button as the switch. Reads the key
+    state pygame keeps from the events the game loop pumps, so it never touches the event queue itself."""
+
+    human = True
+
+    def __init__(self):
+        self.snapshot = InputSnapshot()
+        self.state = None
+
+    def sample(self):
+        keys = pygame.key.get_pressed()
+        left, right, up, down = keys[pygame.K_LEFT], keys[pygame.K_RIGHT], keys[pygame.K_UP], keys[pygame.K_DOWN]
+        clicked = pygame.mouse.get_pressed()[0]
+
+        # Key state is polled, so a change first seen here is as close to its arrival as we can tell
+        state = (left, right, up, down, clicked)
+        if state != self.state:
+            self.state = state
+            x = JOYSTICK_MAX if left else 0 if right else JOYSTICK_CENTER
+            y = JOYSTICK_MAX if up else 0 if down else JOYSTICK_CENTER
+            self.snapshot = InputSnapshot(x, y, 0 if clicked else 1, time.perf_counter())
+        return self.snapshot
+
+
+class AgentSource:
+    """Actions from an RL agent, in [-1, 1] per axis - set one with act() before each update."""
+
+    human = False
+
+    def __init__(self):
+        self.snapshot = InputSnapshot()
+
+    def act(self, action):
+        self.snapshot = InputSnapshot(action_to_reading(action[0]), action_to_reading(action[1]))
+
+    def sample(self):
+        return self.snapshot
+
+
+class ReplaySource:
+    """Recorded input played back - one (x, y, switch) row of `inputs` per sample, from row `tick` on."""
+
+    human = False
+
+    def __init__(self, inputs, tick=0):
+        self.inputs = inputs
+        self.tick = tick
+
+    def sample(self):
+        x, y, switch = self.inputs[self.tick].item()
+        self.tick += 1
+        return InputSnapshot(x, y, switch)
+
+
+def make_input_source():
+    """The input device config asks for - the Arduino joystick if USE_ARDUINO is set, otherwise the keyboard."""
+    if USE_ARDUINO:
+        from arduino_input_handler import ArduinoSource
+        return ArduinoSource()
+    if USE_KEYBOARD:
+        return KeyboardSource()
+    return None
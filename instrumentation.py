@@ -0,0 +1,89 @@
+import numpy as np
+
+
+class RingBuffer:
+    """Fixed-size buffer of the most recent `size` rows of `width` floats - memory stays constant however long
+    it runs."""
+
+    def __init__(self, size, width=1):
+        self.values = np.zeros((size, width))
+        self.size = size
+        self.count = 0
+
+    def next_row(self):
+        """The row to write the next record into (overwriting the oldest once full)."""
+        row = self.values[self.count % self.size]
+        self.count += 1
+        return row
+
+    def append(self, value):
+        self.next_row()[:] = value
+
+    def window(self):
+        """The stored rows (in storage order, not time order)."""
+        return self.values[:min(self.count, self.size)]
+
+
+def describe(values):
+    """mean/p50/p95/min/max of each column."""
+    if len(values) == 0:
+        return {}
+    p50, p95 = np.percentile(values, [50, 95], axis=0)
+    return {'mean': values.mean(axis=0), 'p50': p50, 'p95': p95, 'min': values.min(axis=0), 'max': values.max(axis=0)}
+
+
+class StepInstrumentation:
+    """Per-step phase timings and reward term contributions, kept in ring buffers of the last `window` steps.
+
+    Each step costs one row write per buffer. Every `report_every` steps end_step() returns a summary (phase
+    times in milliseconds, reward term statistics and each term's share of the absolute reward) for the
+    caller to put into the step's info dict.
+    """
+
+    def __init__(self, phases, window=1000, report_every=1000):
+        self.phases = list(phases)
+        self.phase_times = RingBuffer(window, len(self.phases))
+        self.window = window
+        self.report_every = report_every
+        self.steps = 0
+
+        # Reward terms are discovered from the first breakdown recorded
+        self.terms = None
+        self.term_values = None
+
+    def record_phases(self, stamps):
+        """Record one step's phase durations from perf_counter() stamps taken at each phase boundary."""
+        row = self.phase_times.next_row()
+        for i in range(len(self.phases)):
+            row[i] = (stamps[i + 1] - stamps[i]) * 1000
+
+    def record_terms(self, breakdown):
+        if self.terms is None:
+            self.terms = list(breakdown)
+            self.term_values = RingBuffer(self.window, len(self.terms))
+        row = self.term_values.next_row()
+        for i, term in enumerate(self.terms):
+            row[i] = breakdown.get(term, 0.0)
+
+    def end_step(self):
+        """Count a finished step, returning a summary when one is due and None otherwise."""
+        self.steps += 1
+        if self.steps % self.report_every:
+            return None
+        return self.summary()
+
+    def summary(self):
+        summary = {'steps': self.steps, 'phase_ms': self._by_name(self.phases, describe(self.phase_times.window()))}
+
+        if self.terms is not None:
+            values = self.term_values.window()
+            summary['reward_terms'] = self._by_name(self.terms, describe(values))
+            magnitude = np.abs(values).sum(axis=0)
+            share = magnitude / (magnitude.sum() or 1.0)
+            summary['reward_share'] = {term: float(share[i]) for i, term in enumerate(self.terms)}
+
+        return summary
+
+    @staticmethod
+    def _by_name(names, stats):
+        return {name: {stat: float(column[i]) for stat, column in stats.items()} for i, name in enumerate(names)}
@@ -0,0 +1,103 @@
+import json
+
+import numpy as np
+
+from config import *
+from graphics_fx import render_text
+from instrumentation import RingBuffer
+
+# Percentiles shown on the overlay and in the exported summary
+PERCENTILES = (50, 95, 99)
+# Upper edges (milliseconds) of the exported histogram buckets - the last bucket is open-ended
+HISTOGRAM_EDGES_MS = (5, 10, 15, 20, 25, 33, 50, 67, 100, 150, 250)
+
+
+class LatencyMonitor:
+    """Input-to-photon latency of human play.
+
+    Input samples are stamped with time.perf_counter() when they arrive. input_used() is called when a sample
+    feeds the simulation, and frame_presented() right after the frame showing its effect is pushed to the
+    display. Latency (arrival to present), sample age (arrival to use) and frame time are kept in ring
+    buffers over the last `window` events.
+    """
+
+    def __init__(self, window=3600):
+        self.latency = RingBuffer(window)
+        self.sample_age = RingBuffer(window)
+        self.frame_time = RingBuffer(window)
+
+        # Arrival times of samples used since the last present, and the last sample used (each sample counts
+        # only for the first frame it affects)
+        self.pending = []
+        self.last_sample_time = None
+        self.last_present = None
+
+        self.overlay_visible = False
+        self.overlay_lines = []
+        self.overlay_updated = None
+
+    def input_used(self, sample_time, now):
+        if sample_time is None or sample_time == self.last_sample_time:
+            return
+        self.last_sample_time = sample_time
+        self.pending.append(sample_time)
+        self.sample_age.append((now - sample_time) * 1000)
+
+    def frame_presented(self, now):
+        for sample_time in self.pending:
+            self.latency.append((now - sample_time) * 1000)
+        self.pending.clear()
+
+        if self.last_present is not None:
+            self.frame_time.append((now - self.last_present) * 1000)
+        self.last_present = now
+
+    def summary(self):
+        """p50/p95/p99, mean, max and count of each series, in milliseconds."""
+        summary = {}
+        for name, buffer in (('latency_ms', self.latency), ('sample_age_ms', self.sample_age),
+                             ('frame_time_ms', self.frame_time)):
+            values = buffer.window()[:, 0]
+            if len(values) == 0:
+                continue
+            stats = dict(zip((f'p{p}' for p in PERCENTILES), np.percentile(values, PERCENTILES).tolist()))
+            stats.update(mean=float(values.mean()), max=float(values.max()), count=len(values))
+            summary[name] = stats
+        return summary
+
+    def histogram(self):
+        """Latency counts per bucket, keyed by each bucket's upper edge in milliseconds."""
+        edges = np.array(HISTOGRAM_EDGES_MS + (np.inf,))
+        buckets = np.searchsorted(edges, self.latency.window()[:, 0], side='right')
+        counts = np.bincount(buckets, minlength=len(edges))
+        return {f'<{edge:g}' if np.isfinite(edge) else f'>={HISTOGRAM_EDGES_MS[-1]}': int(count)
+                for edge, count in zip(edges, counts)}
+
+    def export(self, path):
+        """Write the summary, latency histogram and raw samples of the current window as JSON."""
+        log = {
+            'summary': self.summary(),
+            'latency_histogram': self.histogram(),
+            'latency_ms': self.latency.window()[:, 0].tolist(),
+            'sample_age_ms': self.sample_age.window()[:, 0].tolist(),
+            'frame_time_ms': self.frame_time.window()[:, 0].tolist(),
+        }
+        with open(path, 'w') as f:
+            json.dump(log, f, indent=2)
+
+    def draw_overlay(self, screen, now, x=10, y=WINDOW_SIZE - 70):
+        """Draw the percentiles in a corner of the screen, returning the rects drawn to. The text is refreshed
+        twice a second so it stays readable (and the text cache isn't flooded)."""
+        if self.overlay_updated is None or now - self.overlay_updated >= 0.5:
+            self.overlay_updated = now
+            summary = self.summary()
+            labels = (('latency_ms', 'input->photon'), ('sample_age_ms', 'sample age'), ('frame_time_ms', 'frame'))
+            self.overlay_lines = [
+                f"{label}: " + ' '.join(f"p{p} {summary[name][f'p{p}']:.1f}" for p in PERCENTILES) + ' ms'
+                for name, label in labels if name in summary
+            ]
+
+        rects = []
+        for i, line in enumerate(self.overlay_lines):
+            rects.append(screen.blit(render_text(line, 24, (255, 255, 255)), (x, y + i * 20)))
+        return rects
@@ -1,20 +1,52 @@
 import pygame
+import random
 import sys
+import time
 from graphics_fx import *
-from arduino_input_handler import Joystick
+from assets import assets
+from input_pipeline import make_input_source, integrate_velocity
 from game_objects import Character, BulletManager, Money
+from sim_clock import SimClock
+from latency import LatencyMonitor
+from profiler import profiler
 
+# Game attributes saved by get_state(), besides the random number generator, clock and game objects
+GAME_STATE = ('episode_seed', 'offset_y', 'score', 'level', 'bullet_speed', 'max_bullets', 'bullet_interval_max',
+              'leveler', 'bullet_interval_max_adj', 'game_over', 'play_again', 'collection_message',
+              'collection_message_visible', 'level_up_msg_visible')
 
 class Game:
-    def __init__(self):
-        pygame.init()
-        self.screen = pygame.display.set_mode((WINDOW_SIZE, WINDOW_SIZE))
-        pygame.display.set_caption('Scrolling Chessboard with Joystick Control')
-
-        # Initialize game objects
+    def __init__(self, headless=False, dirty_rects=DIRTY_RECTS, seed=None, input_source=None, recorders=()):
+        # Headless games simulate without a window - the screen is only created when render() is called - and
+        # only need fonts for drawing, so they never open the display or an audio device
+        self.headless = headless
+        if headless:
+            pygame.font.init()
+            self.screen = None
+        else:
+            pygame.init()
+            self.screen = pygame.display.set_mode((WINDOW_SIZE, WINDOW_SIZE))
+            pygame.display.set_caption('Scrolling Chessboard with Joystick Control')
+
+        # Dirty-rect rendering: screen regions drawn last frame, and the regions to push this frame (None for
+        # the whole screen)
+        self.dirty_rects = dirty_rects
+        self.drawn_rects = []
+        self.update_rects = None
+        self.background_offset = None
+
+        # Simulation clock - advances a fixed step per update(), independent of wall-clock time
+        self.clock = SimClock()
+        self.frame_clock = pygame.time.Clock()
+
+        # Initialize game objects, all drawing from the game's own random number generator - reseeded at the
+        # start of every episode, so an episode plays out the same from its seed and inputs alone
+        self.rng = random.Random(seed)
+        self.episode_seed = self.rng.getrandbits(63) if seed is None else seed
+        self.rng.seed(self.episode_seed)
         self.character = Character()
-        self.bullet_manager = BulletManager()
-        self.money = Money()
+        self.bullet_manager = BulletManager(self.clock, rng=self.rng)
+        self.money = Money(self.clock, rng=self.rng)
 
         self.offset_y = 0
         self.score = 0
@@ -26,11 +58,15 @@ class Game:
         self.leveler = LEVELER  # amount of cash to getting to faster bullet levels
         self.bullet_interval_max_adj = BULLET_INTERVAL_ADJ
 
-        # Initialize joystick handler
-        self.joystick = Joystick()
+        # Input source sampled once per update - the configured device for a windowed game, nothing for a
+        # headless one unless the caller (e.g. an agent) provides a source
+        if input_source is None and not headless:
+            input_source = make_input_source()
+        self.input_source = input_source
+        self.input_snapshot = None
 
-        if USE_ARDUINO or USE_KEYBOARD:
-            self.joystick.start_reading()
+        # Input-to-photon latency of human play
+        self.latency = LatencyMonitor() if input_source is not None and input_source.human else None
 
         # Game state flag
         self.game_over = False
@@ -41,115 +77,224 @@ class Game:
         self.collection_message_visible = False
         self.level_up_msg_visible = False
         self.faster_bullets_msg_visible = False
-        self.collection_message_disappear_time = None
-        self.level_up_msg_disappear_time = None
         self.message_duration = 1.0  # Duration the message stays visible in seconds
 
+        # HUD layers over the sprites, composed again only when the score or health they show changes
+        self.score_layer = CachedLayer(lambda score: compose_score(score, BANK_X, BANK_Y))
+        self.health_layer = CachedLayer(self.compose_health_bar)
+
+        # Recorders told of every episode and update - replay.EpisodeRecorder and dataset.TrajectoryWriter
+        self.recorders = list(recorders)
+        for recorder in self.recorders:
+            recorder.begin_episode(self)
+
     def run(self):
+        # Fixed-timestep loop: the simulation advances in SIM_DT steps to catch up with real time, and each
+        # frame is drawn part way between the last two steps
+        accumulator = 0.0
+        previous = time.perf_counter()
+
         running = True
         while running:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    running = False
+            with profiler.phase('events'):
+                for event in pygame.event.get():
+                    if event.type == pygame.QUIT:
+                        running = False
+                    elif event.type == pygame.KEYDOWN:
+                        self.handle_key(event.key)
+
+                # Loop background music
+                assets.play('background', restart=False)
+
+            # Update game state - as many steps as real time has moved on
+            now = time.perf_counter()
+            accumulator += now - previous
+            previous = now
+            steps = 0
+            while accumulator >= SIM_DT and steps < MAX_CATCH_UP_STEPS:
+                with profiler.phase('update'):
+                    self.update()
+                accumulator -= SIM_DT
+                steps += 1
+            if steps == MAX_CATCH_UP_STEPS:
+                # Too far behind (a stall, or a machine too slow to keep up) - drop the backlog
+                accumulator = min(accumulator, SIM_DT)
 
-            # Loop background music
-            if not background_channel.get_busy():
-                background_channel.play(background_music)
+            # Draw everything
+            with profiler.phase('render'):
+                self.render(alpha=accumulator / SIM_DT)
 
-            # Update game state
-            self.update()
+            with profiler.phase('present'):
+                self.present()
+            profiler.end_frame()
 
-            # Draw everything
-            self.render()
+            # Cap the frame rate - sleeps only the time left in the frame
+            self.frame_clock.tick(RENDER_FPS)
 
-            pygame.display.flip()
-            pygame.time.delay(30)
+        if LATENCY_LOG and self.latency is not None:
+            self.latency.export(LATENCY_LOG)
+        for recorder in self.recorders:
+            recorder.close()
 
         pygame.quit()
         sys.exit()
 
+    def handle_key(self, key):
+        # Debug keys: F3 latency overlay, F4 frame profiler overlay, F5 write the profiler's trace
+        if key == pygame.K_F3 and self.latency is not None:
+            self.latency.overlay_visible = not self.latency.overlay_visible
+        elif key == pygame.K_F4:
+            profiler.set_enabled(not profiler.enabled)
+        elif key == pygame.K_F5 and profiler.enabled and PROFILE_TRACE:
+            profiler.dump_trace(PROFILE_TRACE)
+
     def update(self, velocity_x=None, velocity_y=None):
+        # Advance the simulation clock and handle any timers that came due
+        for timer in self.clock.advance():
+            self.handle_timer(timer)
+
         # Update scrolling background
         self.offset_y += SCROLL_SPEED
         if self.offset_y >= TILE_HEIGHT:
             self.offset_y = 0
 
-        # Update character position
-        if USE_ARDUINO or USE_KEYBOARD:
-            velocity_x, velocity_y = self.joystick.get_velocity()
+        # Update character position, steered by this tick's input unless velocities are given
+        if velocity_x is None and self.input_source is not None:
+            self.steer(self.input_source.sample())
+            velocity_x, velocity_y = self.character.velocity_x, self.character.velocity_y
 
         self.character.move(velocity_x, velocity_y)
 
         self.level_up_bullets()
 
-        self.bullet_manager.update(bullet_speed=self.bullet_speed, max_bullets=self.max_bullets, bullet_interval_max=self.bullet_interval_max)
+        with profiler.phase('bullets'):
+            self.bullet_manager.update(bullet_speed=self.bullet_speed, max_bullets=self.max_bullets, bullet_interval_max=self.bullet_interval_max)
 
-        self.collect_money()
-
-        if not self.money.visible:
-            self.money.respawn()
+        with profiler.phase('collision'):
+            self.collect_money()
+            hit = self.character.check_bullet_collision(self.bullet_manager)
 
-        if self.character.check_bullet_collision(self.bullet_manager.bullets):
+        if hit:
             self.character.health -= BULLET_DAMAGE
             # Play the gunshot sound only if it's not already playing
-            if not gunshot_channel.get_busy():
-                gunshot_channel.play(gunshot_sound)
+            if not self.headless:
+                assets.play('gunshot', restart=False)
 
         if self.character.health <= 0:
             self.game_over = True
             self.play_again = True
-            return
-
-    def render(self):
-        # Clear screen
-        self.screen.fill((0, 0, 0))
-
-        # Draw scrolling background
-        draw_tiled_background(self.screen, self.offset_y)
 
+        for recorder in self.recorders:
+            recorder.record(self)
+
+    def render(self, alpha=1.0):
+        # Headless games draw to an offscreen surface, created on the first render
+        if self.screen is None:
+            self.screen = pygame.Surface((WINDOW_SIZE, WINDOW_SIZE))
+
+        # Moving things are drawn alpha of the way from the previous simulation step to the current one
+        offset_y = self.offset_y - SCROLL_SPEED * (1 - alpha)
+        if offset_y < 0:
+            offset_y += TILE_HEIGHT
+
+        with profiler.phase('background'):
+            if self.dirty_rects and offset_y == self.background_offset:
+                # Background hasn't moved - only erase what was drawn last frame
+                for rect in self.drawn_rects:
+                    self.draw_background(rect)
+                self.update_rects = list(self.drawn_rects)
+            else:
+                self.background_offset = offset_y
+                self.draw_background()
+                self.update_rects = None
+
+        with profiler.phase('sprites'):
+            self.drawn_rects = self.draw_sprites(alpha)
+        if self.latency is not None and self.latency.overlay_visible:
+            self.drawn_rects.extend(self.latency.draw_overlay(self.screen, time.perf_counter()))
+        if profiler.enabled and not self.headless:
+            self.drawn_rects.extend(profiler.draw_overlay(self.screen, time.perf_counter()))
+        if self.update_rects is not None:
+            self.update_rects.extend(self.drawn_rects)
+
+    def draw_background(self, rect=None):
+        # Draw the scrolling background, over just rect of the screen if given
+        draw_tiled_background(self.screen, self.background_offset, rect)
+
+    def draw_sprites(self, alpha=1.0):
+        """Draw everything over the background, returning the screen rects drawn to."""
         if self.game_over:
-            self.show_end_screen()
-
+            return self.show_end_screen()
+
+        # The character, bullets and money, submitted in one blits call - their rects are only needed to erase
+        # them next frame with dirty rects
+        sprites = [self.character.sprite(alpha)]
+        sprites.extend(self.bullet_manager.sprites(alpha))
+        if self.money.visible:
+            sprites.append(self.money.sprite())
+        if self.dirty_rects:
+            rects = self.screen.blits(sprites)
         else:
-            # Draw character
-            self.character.draw(self.screen)
+            self.screen.blits(sprites, doreturn=False)
+            rects = []
 
-            # Draw bullets
-            self.bullet_manager.draw(self.screen)
+        # Draw the bank and score, and the health bar - each redrawn only when what it shows changes
+        rects.append(self.score_layer.draw(self.screen, self.score))
+        rects.append(self.health_layer.draw(self.screen, self.character.health))
 
-            # Draw money
-            self.money.draw(self.screen)
+        # Show relevant messages
+        rects.extend(self.show_messages())
 
-            # Draw score
-            draw_bank(self.screen, BANK_X, BANK_Y)
-            draw_score(self.screen, self.score, BANK_X, BANK_Y)
+        return rects
 
-            # Draw health bar
-            self.draw_health_bar()
+    def present(self):
+        # Push the frame to the window - just the changed regions when they are known
+        if self.update_rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(self.update_rects)
 
-            # Show relevant messages
-            self.show_messages()
+        if self.latency is not None:
+            self.latency.frame_presented(time.perf_counter())
 
     def show_messages(self):
+        rects = []
         if self.collection_message_visible:
-            self.draw_collection_message()
-            if pygame.time.get_ticks() - self.collection_message_disappear_time > self.message_duration * 1000:
-                self.collection_message_visible = False
+            rects.append(self.draw_collection_message())
 
         if self.level_up_msg_visible:
-            self.draw_message(LVL_UP_MSG, SKY_BLUE, font_size=48)
-            if pygame.time.get_ticks() - self.level_up_msg_disappear_time > self.message_duration * 1000:
-                self.level_up_msg_visible = False
+            rects.append(self.draw_message(LVL_UP_MSG, SKY_BLUE, font_size=48))
+
+        return rects
+
+    def handle_timer(self, timer):
+        if timer == BULLET_SPAWN_TIMER:
+            self.bullet_manager.spawn_due = True
+        elif timer == MONEY_RESPAWN_TIMER:
+            self.money.respawn()
+        elif timer == COLLECTION_MSG_TIMER:
+            self.collection_message_visible = False
+        elif timer == LEVEL_UP_MSG_TIMER:
+            self.level_up_msg_visible = False
 
     def collect_money(self):
         # Check for collisions with money
         if self.money.visible and self.character.check_collision(self.money.x, self.money.y):
             points = self.money.collect()
             self.score += points
-            cash_channel.play(cash_sound)
+            if not self.headless:
+                assets.play('cash')
             self.collection_message = f"+${points}!"
             self.collection_message_visible = True
-            self.collection_message_disappear_time = pygame.time.get_ticks()
+            self.clock.schedule(COLLECTION_MSG_TIMER, self.message_duration)
+
+    def steer(self, snapshot):
+        # Integrate the character's velocity from an input snapshot
+        self.input_snapshot = snapshot
+        self.character.velocity_x = integrate_velocity(self.character.velocity_x, snapshot.x)
+        self.character.velocity_y = integrate_velocity(self.character.velocity_y, snapshot.y)
+        if self.latency is not None:
+            self.latency.input_used(snapshot.sample_time, time.perf_counter())
 
     def level_up_bullets(self):
         # Update bullet difficulties
@@ -165,45 +310,61 @@ class Game:
             # Level up
             self.level += 1
             self.level_up_msg_visible = True
-            self.level_up_msg_disappear_time = pygame.time.get_ticks()
+            self.clock.schedule(LEVEL_UP_MSG_TIMER, self.message_duration)
 
     def show_end_screen(self):
         # Stop the gunshot sound
-        gunshot_channel.stop()
+        assets.stop('gunshot')
 
         # Calculate the center of the screen
+        end_image = assets.image('end')
         end_image_x = (WINDOW_SIZE - end_image.get_width()) // 2
         end_image_y = (WINDOW_SIZE - end_image.get_height()) // 2
 
         # Draw the end image in the center
-        self.screen.blit(end_image, (end_image_x, end_image_y))
+        rects = [self.screen.blit(end_image, (end_image_x, end_image_y))]
 
-        # Draw the score text underneath the end image
-        font = pygame.font.Font(None, 96)  # Use a larger font size for the score
-        score_text = font.render(f"Your score was {self.score}.", True, BLOOD_RED)
+        # Draw the score text underneath the end image, in a larger font size
+        score_text = render_text(f"Your score was {self.score}.", 96, BLOOD_RED)
         text_x = (WINDOW_SIZE - score_text.get_width()) // 2
         text_y = end_image_y + end_image.get_height()  # Position below the image
-        self.screen.blit(score_text, (text_x, text_y))
+        rects.append(self.screen.blit(score_text, (text_x, text_y)))
 
-        score_text = font.render(f"Click to play again!", True, BLOOD_RED)
-        self.screen.blit(score_text, (text_x, text_y + 60))
+        score_text = render_text("Click to play again!", 96, BLOOD_RED)
+        rects.append(self.screen.blit(score_text, (text_x, text_y + 60)))
 
-        if self.joystick.joystick_switch == 0:
+        if self.input_snapshot is not None and self.input_snapshot.switch == 0:
             self.reset_game()
-            return
 
-    def reset_game(self):
+        return rects
+
+    def reset_game(self, seed=None):
+        # Close the recordings of the episode being left, then start the next one from a fresh seed (drawn
+        # from the last one unless given)
+        for recorder in self.recorders:
+            recorder.end_episode(self)
+        self.episode_seed = self.rng.getrandbits(63) if seed is None else seed
+        self.rng.seed(self.episode_seed)
+
         # Reset character's position and health
         self.character.reset_position()  # You need to implement this method in your character class
         self.character.health = START_HEALTH  # Set to whatever the initial health is
 
-        # Reset the score and level parameters
+        # Reset the score and level parameters, and the scrolling background
+        self.offset_y = 0
         self.score = 0
         self.level = 1
         self.bullet_speed = BULLET_SPEED
         self.max_bullets = MAX_BULLETS
+        self.bullet_interval_max = BULLET_INTERVAL_MAX
         self.leveler = LEVELER  # amount of cash to getting to faster bullet levels
 
+        # Restart the simulation clock - this also drops any pending timers
+        self.clock.reset()
+        self.collection_message = ""
+        self.collection_message_visible = False
+        self.level_up_msg_visible = False
+
         # Reset the bullet manager
         self.bullet_manager.reset()  # Implement this method in your bullet manager class
 
@@ -217,7 +378,30 @@ class Game:
         # Reset other game-related states like enemies, obstacles, etc.
         # self.enemies.reset()  # If you have enemies, implement this method in your enemies manager
 
-    def draw_health_bar(self):
+        for recorder in self.recorders:
+            recorder.begin_episode(self)
+
+    def get_state(self):
+        """Everything the simulation depends on, as plain data - set_state() puts a game back in this state, to
+        carry on exactly as it would have from here."""
+        state = {name: getattr(self, name) for name in GAME_STATE}
+        state['rng'] = self.rng.getstate()
+        state['clock'] = self.clock.get_state()
+        state['character'] = self.character.get_state()
+        state['bullet_manager'] = self.bullet_manager.get_state()
+        state['money'] = self.money.get_state()
+        return state
+
+    def set_state(self, state):
+        for name in GAME_STATE:
+            setattr(self, name, state[name])
+        self.rng.setstate(state['rng'])
+        self.clock.set_state(state['clock'])
+        self.character.set_state(state['character'])
+        self.bullet_manager.set_state(state['bullet_manager'])
+        self.money.set_state(state['money'])
+
+    def compose_health_bar(self, health):
         # Define the size and position of the health bar
         bar_width = BANK_SIZE
         bar_height = 20
@@ -225,30 +409,30 @@ class Game:
         bar_y = 100
 
         # Calculate the width of the health bar
-        health_percentage = max(self.character.health / START_HEALTH, 0)
+        health_percentage = max(health / START_HEALTH, 0)
         green_width = int(bar_width * health_percentage)
         red_width = bar_width - green_width
 
-        # Draw the green portion of the health bar
-        pygame.draw.rect(self.screen, (0, 255, 0), (bar_x, bar_y, green_width, bar_height))
-
-        # Draw the red portion of the health bar (if any)
+        # The green portion of the health bar, then the red portion (if any)
+        items = []
+        if green_width > 0:
+            items.append((filled_surface((green_width, bar_height), (0, 255, 0)), (bar_x, bar_y)))
         if red_width > 0:
-            pygame.draw.rect(self.screen, (255, 0, 0), (bar_x + green_width, bar_y, red_width, bar_height))
+            items.append((filled_surface((red_width, bar_height), (255, 0, 0)), (bar_x + green_width, bar_y)))
 
         # Position the heart image at the right edge of the green bar
+        heart_image = assets.image('heart')
         heart_x = bar_x + green_width - heart_image.get_width() // 2  # Position at the end of the green bar
         heart_y = bar_y + (bar_height - heart_image.get_height()) // 2  # Centered vertically with the bar
-        self.screen.blit(heart_image, (heart_x, heart_y))
+        items.append((heart_image, (heart_x, heart_y)))
+        return items
 
     def draw_collection_message(self):
-        font = pygame.font.Font(None, 36)  # Use the default font, size 36
-        message_text = font.render(self.collection_message, True, MONEY_GREEN)
-        self.screen.blit(message_text, (self.money.x, self.money.y - 40))  # Display above the money
+        message_text = render_text(self.collection_message, 36, MONEY_GREEN)  # Default font, size 36
+        return self.screen.blit(message_text, (self.money.x, self.money.y - 40))  # Display above the money
 
     def draw_message(self, message, colour, x=None, y=None, font_size=36):
-        font = pygame.font.Font(None, font_size)
-        message_text = font.render(message, True, colour)
+        message_text = render_text(message, font_size, colour)
 
         # Get the dimensions of the text
         text_rect = message_text.get_rect()
@@ -262,9 +446,16 @@ class Game:
             y = (WINDOW_SIZE - text_rect.height) // 2
 
         # Draw the text on the screen
-        self.screen.blit(message_text, (x, y))
+        return self.screen.blit(message_text, (x, y))
 
 
 if __name__ == "__main__":
-    game = Game()
+    recorders = []
+    if REPLAY_LOG:
+        from replay import EpisodeRecorder
+        recorders.append(EpisodeRecorder(REPLAY_LOG))
+    if DATASET_DIR:
+        from dataset import TrajectoryWriter
+        recorders.append(TrajectoryWriter(DATASET_DIR))
+    game = Game(recorders=recorders)
     game.run()
@@ -0,0 +1,131 @@
+import json
+import time
+from collections import deque
+
+import numpy as np
+
+from config import *
+from instrumentation import RingBuffer
+
+# Phases of a frame of Game.run, in overlay order - indented ones are nested in the phase above them
+FRAME_PHASES = ('events', 'update', '  bullets', '  collision', 'render', '  background', '  sprites', '    text',
+                'present')
+
+
+class _Scope:
+    """Times one phase - entered and exited around the code it measures."""
+
+    __slots__ = ('profiler', 'index', 'name', 'start')
+
+    def __init__(self, profiler, index, name):
+        self.profiler = profiler
+        self.index = index
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self.profiler.frame[self.index] += end - self.start
+        if self.profiler.trace is not None:
+            self.profiler.trace.append((self.name, self.start, end))
+
+
+class _NullScope:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_SCOPE = _NullScope()
+
+
+class FrameProfiler:
+    """Scoped timers around the phases of a frame: `with profiler.phase('update'): ...`.
+
+    Each phase's total for the frame goes into a ring buffer of the last `window` frames when end_frame() is
+    called. While disabled, phase() hands back a shared do-nothing scope, so instrumented code pays only a
+    method call. While tracing, every timed scope is also kept (up to max_trace_events) for dump_trace().
+    """
+
+    def __init__(self, phases=FRAME_PHASES, window=300, max_trace_events=200000):
+        self.phases = [phase.strip() for phase in phases]
+        self.labels = list(phases)
+        self.scopes = {name: _Scope(self, i, name) for i, name in enumerate(self.phases)}
+        self.times = RingBuffer(window, len(self.phases))
+        self.frame_times = RingBuffer(window)
+        self.frame = np.zeros(len(self.phases))
+        self.last_frame_end = None
+
+        self.enabled = False
+        self.max_trace_events = max_trace_events
+        self.trace = None
+
+        self.overlay_lines = []
+        self.overlay_updated = None
+
+    def phase(self, name):
+        return self.scopes[name] if self.enabled else NULL_SCOPE
+
+    def set_enabled(self, enabled, trace=True):
+        self.enabled = enabled
+        self.trace = deque(maxlen=self.max_trace_events) if enabled and trace else None
+        self.last_frame_end = None
+        self.frame[:] = 0
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.times.append(self.frame * 1000)
+        self.frame[:] = 0
+        if self.last_frame_end is not None:
+            self.frame_times.append((now - self.last_frame_end) * 1000)
+        self.last_frame_end = now
+
+    def summary(self):
+        """Mean and p95 milliseconds per frame of each phase, and the frame rate."""
+        times = self.times.window()
+        if len(times) == 0:
+            return {}
+        p95 = np.percentile(times, 95, axis=0)
+        summary = {name: {'mean_ms': float(times[:, i].mean()), 'p95_ms': float(p95[i])}
+                   for i, name in enumerate(self.phases)}
+        frame_times = self.frame_times.window()
+        if len(frame_times):
+            summary['fps'] = 1000 / float(frame_times.mean())
+        return summary
+
+    def dump_trace(self, path):
+        """Write the traced scopes as Chrome trace events (load in chrome://tracing or Perfetto)."""
+        events = [{'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': (end - start) * 1e6, 'pid': 0, 'tid': 0}
+                  for name, start, end in (self.trace or ())]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return len(events)
+
+    def draw_overlay(self, screen, now, x=WINDOW_SIZE - 230, y=160):
+        """Draw ms per phase and FPS down the right of the screen, returning the rects drawn to (refreshed
+        twice a second)."""
+        from graphics_fx import render_text
+
+        if self.overlay_updated is None or now - self.overlay_updated >= 0.5:
+            self.overlay_updated = now
+            summary = self.summary()
+            self.overlay_lines = [f"{summary.get('fps', 0):.0f} fps"] + [
+                f"{label}: {summary[name]['mean_ms']:.2f} ms" for label, name in zip(self.labels, self.phases)
+                if name in summary
+            ]
+
+        return [screen.blit(render_text(line, 24, (255, 255, 255)), (x, y + i * 20))
+                for i, line in enumerate(self.overlay_lines)]
+
+
+# Shared by the game loop and the drawing helpers
+profiler = FrameProfiler()
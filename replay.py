@@ -0,0 +1,292 @@
+"""Episode recording and deterministic replay.
+
+An episode is fully determined by its seed and the input sampled on each update, so that is all a recording
+keeps - five bytes a tick - plus a snapshot of the game state every so often to jump into the middle of one.
+Replay re-runs the simulation headless from the seed (or the nearest snapshot) as fast as it will go.
+
+A replay file is append-only: a header, then records of a one-byte type, a little-endian uint32 payload length
+and the payload. Every record belongs to the episode most recently started:
+
+    E  episode start - seed, whether the input came from a human, and the wall-clock start time
+    I  input chunk - consecutive ticks of (x, y, switch) joystick readings, as INPUT_DTYPE rows
+    S  snapshot - tick, then the pickled Game.get_state() after that many updates
+    F  episode end - ticks, score, level, whether the game was lost, and a digest of the final state
+
+Files are read through a memory map, and scanning one only touches the record headers and episode records -
+an episode's input is read when it is asked for. Each recorder needs a file of its own.
+"""
+import argparse
+import hashlib
+import io
+import os
+import pickle
+import struct
+import sys
+import time
+
+import numpy as np
+
+from config import *
+
+FILE_MAGIC = b'JSREPLAY'
+FORMAT_VERSION = 1
+FILE_HEADER = struct.Struct('<8sH')
+RECORD_HEADER = struct.Struct('<cI')
+EPISODE_START = struct.Struct('<Q?d')
+EPISODE_END = struct.Struct('<IiI?8s')
+SNAPSHOT_TICK = struct.Struct('<I')
+
+START, INPUT, SNAPSHOT, END = b'E', b'I', b'S', b'F'
+
+# One tick of input - agents' actions are stored as the joystick readings they map to, which is all the
+# simulation sees of them
+INPUT_DTYPE = np.dtype([('x', '<u2'), ('y', '<u2'), ('switch', 'u1')])
+
+PICKLE_PROTOCOL = 4
+
+
+def state_digest(game):
+    """8-byte fingerprint of a game's state - equal only when the simulation is in exactly the same state."""
+    buffer = io.BytesIO()
+    pickler = pickle.Pickler(buffer, protocol=PICKLE_PROTOCOL)
+    pickler.fast = True  # no memo, so the bytes depend only on the values and not on which objects are shared
+    pickler.dump(game.get_state())
+    return hashlib.sha1(buffer.getvalue()).digest()[:8]
+
+
+class EpisodeRecorder:
+    """Appends every episode a Game plays to a replay file - pass it to Game (or MyGameEnv) in `recorders`.
+
+    The game calls begin_episode() when an episode starts, record() after every update and end_episode()
+    when it resets. An episode ends by itself when the game is lost; one left part way (a reset mid-episode,
+    or close()) is ended where it stands. Episodes without a single update are not written.
+    """
+
+    def __init__(self, path, snapshot_every=REPLAY_SNAPSHOT_EVERY, chunk_ticks=256):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(FILE_HEADER.pack(FILE_MAGIC, FORMAT_VERSION))
+
+        self.chunk = np.zeros(chunk_ticks, dtype=INPUT_DTYPE)
+        self.chunk_length = 0
+        self.game = None
+        self.start = None  # start record of the episode, written with its first tick
+        self.ticks = 0
+
+    def begin_episode(self, game):
+        if game.input_source is None:
+            raise ValueError('Only games steered by an input source can be recorded')
+        self.end_episode(game)
+        self.game = game
+        self.start = EPISODE_START.pack(game.episode_seed, game.input_source.human, time.time())
+        self.ticks = 0
+
+    def record(self, game):
+        if self.game is None:
+            return  # the episode has ended, and the game is waiting to be reset
+        if self.ticks == 0:
+            self._write(START, self.start)
+
+        snapshot = game.input_snapshot
+        self.chunk[self.chunk_length] = (snapshot.x, snapshot.y, snapshot.switch)
+        self.chunk_length += 1
+        self.ticks += 1
+        if self.chunk_length == len(self.chunk):
+            self._flush_input()
+
+        if game.game_over:
+            self.end_episode(game)
+        elif self.ticks % self.snapshot_every == 0:
+            # Input up to the snapshot is written first, so a file cut off after it can still seek to it
+            self._flush_input()
+            state = pickle.dumps(game.get_state(), protocol=PICKLE_PROTOCOL)
+            self._write(SNAPSHOT, SNAPSHOT_TICK.pack(self.ticks) + state)
+            self.file.flush()
+
+    def end_episode(self, game):
+        if self.game is None:
+            return
+        if self.ticks:
+            self._flush_input()
+            self._write(END, EPISODE_END.pack(self.ticks, game.score, game.level, game.game_over,
+                                              state_digest(game)))
+            self.file.flush()
+        self.game = None
+
+    def close(self):
+        if self.game is not None:
+            self.end_episode(self.game)
+        self.file.close()
+
+    def _flush_input(self):
+        if self.chunk_length:
+            self._write(INPUT, self.chunk[:self.chunk_length].tobytes())
+            self.chunk_length = 0
+
+    def _write(self, kind, payload):
+        self.file.write(RECORD_HEADER.pack(kind, len(payload)))
+        self.file.write(payload)
+
+
+class Episode:
+    """One episode of a ReplayFile: its seed and outcome (None for episodes cut off before they ended), and
+    where its input and snapshots are in the file."""
+
+    def __init__(self, data, seed, human, start_time):
+        self.data = data
+        self.seed = seed
+        self.human = human
+        self.start_time = start_time
+        self.chunks = []  # (offset, ticks) of each input chunk
+        self.snapshots = []  # (tick, offset, length) of each snapshot's pickled state
+        self.ticks = 0
+
+        self.finished = False
+        self.score = None
+        self.level = None
+        self.game_over = None
+        self.digest = None
+
+    def inputs(self):
+        """The episode's input, one INPUT_DTYPE row a tick - a view of the mapped file when it is in one
+        chunk."""
+        views = [self.data[offset:offset + ticks * INPUT_DTYPE.itemsize].view(INPUT_DTYPE)
+                 for offset, ticks in self.chunks]
+        if len(views) == 1:
+            return views[0]
+        return np.concatenate(views) if views else np.zeros(0, dtype=INPUT_DTYPE)
+
+    def snapshot(self, tick):
+        """(tick, state) of the latest snapshot at or before tick, or None if there is none."""
+        best = None
+        for snapshot in self.snapshots:
+            if snapshot[0] <= tick:
+                best = snapshot
+        if best is None:
+            return None
+        snapshot_tick, offset, length = best
+        return snapshot_tick, pickle.loads(self.data[offset:offset + length])
+
+
+class ReplayFile:
+    """The episodes recorded in a replay file, read through a memory map. A record left half-written (by a
+    recorder that is still running or was killed) ends the scan."""
+
+    def __init__(self, path):
+        self.path = path
+        self.episodes = []
+        if os.path.getsize(path) < FILE_HEADER.size:
+            raise ValueError(f'{path} is not a replay file')
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+
+        magic, version = FILE_HEADER.unpack_from(self.data)
+        if magic != FILE_MAGIC:
+            raise ValueError(f'{path} is not a replay file')
+        if version != FORMAT_VERSION:
+            raise ValueError(f'{path} is replay format {version}, expected {FORMAT_VERSION}')
+        self._scan(FILE_HEADER.size)
+
+    def _scan(self, offset):
+        episode = None
+        size = len(self.data)
+        while offset + RECORD_HEADER.size <= size:
+            kind, length = RECORD_HEADER.unpack_from(self.data, offset)
+            offset += RECORD_HEADER.size
+            if offset + length > size:
+                break
+
+            if kind == START:
+                episode = Episode(self.data, *EPISODE_START.unpack_from(self.data, offset))
+                self.episodes.append(episode)
+            elif episode is None:
+                raise ValueError(f'{self.path}: record before the first episode at byte {offset}')
+            elif kind == INPUT:
+                ticks = length // INPUT_DTYPE.itemsize
+                episode.chunks.append((offset, ticks))
+                episode.ticks += ticks
+            elif kind == SNAPSHOT:
+                tick, = SNAPSHOT_TICK.unpack_from(self.data, offset)
+                episode.snapshots.append((tick, offset + SNAPSHOT_TICK.size, length - SNAPSHOT_TICK.size))
+            elif kind == END:
+                ticks, episode.score, episode.level, episode.game_over, episode.digest = \
+                    EPISODE_END.unpack_from(self.data, offset)
+                episode.finished = True
+            offset += length
+
+    def __len__(self):
+        return len(self.episodes)
+
+    def __getitem__(self, index):
+        return self.episodes[index]
+
+    def __iter__(self):
+        return iter(self.episodes)
+
+
+def replay(episode, tick=None, use_snapshots=True):
+    """Re-simulate an episode headless up to tick (its end by default), starting from the latest snapshot at
+    or before it (or from the seed, without use_snapshots), and return the Game in the state it was in after
+    that many updates."""
+    from main import Game
+    from input_pipeline import ReplaySource
+
+    inputs = episode.inputs()
+    tick = len(inputs) if tick is None else tick
+    if not 0 <= tick <= len(inputs):
+        raise ValueError(f'tick {tick} is outside the episode (0 to {len(inputs)})')
+
+    source = ReplaySource(inputs)
+    game = Game(headless=True, input_source=source)
+    game.reset_game(seed=episode.seed)
+    snapshot = episode.snapshot(tick) if use_snapshots else None
+    if snapshot is not None:
+        source.tick, state = snapshot
+        game.set_state(state)
+
+    for _ in range(tick - source.tick):
+        game.update()
+    return game
+
+
+def verify(episode):
+    """Whether replaying a finished episode from its seed ends in exactly the state it was recorded ending in."""
+    if not episode.finished:
+        raise ValueError('Only finished episodes can be verified')
+    return state_digest(replay(episode, use_snapshots=False)) == episode.digest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='List, verify or replay the episodes in a replay file.')
+    parser.add_argument('path')
+    parser.add_argument('--verify', action='store_true', help='replay every finished episode and check its end state')
+    parser.add_argument('--episode', type=int, help='replay this episode (by index)')
+    parser.add_argument('--tick', type=int, help='replay the episode up to this tick (default: its end)')
+    args = parser.parse_args(argv)
+
+    episodes = ReplayFile(args.path)
+    if args.episode is not None:
+        start = time.perf_counter()
+        game = replay(episodes[args.episode], args.tick)
+        elapsed = time.perf_counter() - start
+        print(f'tick {game.clock.tick}: score {game.score}, level {game.level}, health {game.character.health}, '
+              f'{game.bullet_manager.count()} bullets ({elapsed * 1000:.0f} ms)')
+        return 0
+
+    status = 0
+    for i, episode in enumerate(episodes):
+        line = (f"{i:5d}  seed {episode.seed:<20d} {'human' if episode.human else 'agent'}  {episode.ticks:7d} ticks"
+                + (f'  score {episode.score}, level {episode.level}' if episode.finished else '  (unfinished)'))
+        if args.verify and episode.finished:
+            start = time.perf_counter()
+            ok = verify(episode)
+            rate = episode.ticks / (time.perf_counter() - start)
+            line += f"  {'ok' if ok else 'MISMATCH'} ({rate:.0f} ticks/s)"
+            status = status or not ok
+        print(line)
+    return int(status)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,254 @@
+import numpy as np
+from config import *
+
+MAX_DISTANCE = np.sqrt(WINDOW_SIZE ** 2 + WINDOW_SIZE ** 2)  # diagonal of the screen
+CENTER = WINDOW_SIZE // 2
+MAX_DISTANCE_FROM_CENTER = np.sqrt(CENTER ** 2 + CENTER ** 2)
+
+# Reward term kernels by name - each maps a StepGeometry to one value per game
+REWARD_TERMS = {}
+
+
+def reward_term(name):
+    """Register a reward term kernel under `name`."""
+    def register(kernel):
+        REWARD_TERMS[name] = kernel
+        return kernel
+    return register
+
+
+class lazy_attribute:
+    """Computed on first access and then stored on the instance - functools.cached_property without the lock,
+    which is a noticeable share of a step's reward cost."""
+
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.name] = self.func(obj)
+        return value
+
+
+class StepGeometry:
+    """Everything the reward terms need for one step.
+
+    For a batch of games the character and money fields are (n_games,) arrays and the bullet fields are
+    (n_games, slots) arrays with an active mask. For a single game they are plain scalars and 1-D arrays of
+    the active bullets, which keeps per-step NumPy overhead low - terms reduce bullets over axis=-1 and so
+    work on either, counting bullets through count(). Derived quantities (distances, speed, line of fire) are
+    computed on first use and then cached, so each is worked out at most once per step however many terms
+    read it.
+    """
+
+    def __init__(self, x, y, velocity_x, velocity_y, bullet_x, bullet_y, bullet_active, money_x, money_y,
+                 money_visible, money_age, time, collecting, health, prev_health):
+        self.batched = isinstance(x, np.ndarray)
+        self.n_games = len(x) if self.batched else 1
+        self.x = x
+        self.y = y
+        self.velocity_x = velocity_x
+        self.velocity_y = velocity_y
+        self.bullet_x = bullet_x
+        self.bullet_y = bullet_y
+        self.bullet_active = bullet_active
+        self.money_x = money_x
+        self.money_y = money_y
+        self.money_visible = money_visible
+        self.money_age = money_age
+        self.time = time
+        self.collecting = collecting
+        self.health = health
+        self.prev_health = prev_health
+
+    @lazy_attribute
+    def speed(self):
+        return np.sqrt(self.velocity_x ** 2 + self.velocity_y ** 2)
+
+    @lazy_attribute
+    def center_distance(self):
+        return np.sqrt((self.x - CENTER) ** 2 + (self.y - CENTER) ** 2)
+
+    @lazy_attribute
+    def money_distance(self):
+        return np.sqrt((self.x - self.money_x) ** 2 + (self.y - self.money_y) ** 2)
+
+    @lazy_attribute
+    def hurt(self):
+        return self.health < self.prev_health
+
+    @lazy_attribute
+    def dead(self):
+        return self.health <= 0
+
+    @lazy_attribute
+    def bullet_dx(self):
+        return self.bullet_x - (self.x[:, None] if self.batched else self.x)
+
+    @lazy_attribute
+    def bullet_dy(self):
+        return self.bullet_y - (self.y[:, None] if self.batched else self.y)
+
+    @lazy_attribute
+    def bullet_distance(self):
+        return np.sqrt(self.bullet_dx ** 2 + self.bullet_dy ** 2)
+
+    @lazy_attribute
+    def in_line_of_fire(self):
+        return self.bullet_active & (np.abs(self.bullet_dx) < 50)
+
+    def count(self, bullet_mask):
+        """Number of bullets selected by a mask, per game."""
+        return bullet_mask.sum(axis=-1) if self.batched else int(np.count_nonzero(bullet_mask))
+
+    @classmethod
+    def from_game(cls, game, prev_health):
+        """Geometry of a single main.Game."""
+        character, money = game.character, game.money
+        bullet_x, bullet_y = game.bullet_manager.positions()
+        return cls(
+            x=character.x, y=character.y, velocity_x=character.velocity_x, velocity_y=character.velocity_y,
+            bullet_x=bullet_x, bullet_y=bullet_y, bullet_active=True,
+            money_x=money.x, money_y=money.y, money_visible=money.visible,
+            money_age=game.clock.time - money.appear_time, time=game.clock.time,
+            collecting=game.collection_message_visible, health=character.health, prev_health=prev_health,
+        )
+
+    @classmethod
+    def from_vec_game(cls, game, prev_health):
+        """Geometry of every game in a vec_game.VecGame."""
+        return cls(
+            x=game.x, y=game.y, velocity_x=game.velocity_x, velocity_y=game.velocity_y,
+            bullet_x=game.bullet_x, bullet_y=game.bullet_y, bullet_active=game.bullet_active,
+            money_x=game.money_x, money_y=game.money_y, money_visible=game.money_visible,
+            money_age=(game.tick - game.money_appear_tick) * SIM_DT, time=game.time,
+            collecting=game.collection_message_visible, health=game.health, prev_health=prev_health,
+        )
+
+
+class RewardEngine:
+    """Weighted sum of registered reward terms, e.g. RewardEngine([('survival_v2', 1.0), ...])."""
+
+    def __init__(self, terms):
+        self.terms = [(name, REWARD_TERMS[name], weight) for name, weight in terms]
+        self.term_names = [name for name, _, _ in self.terms]
+
+    def evaluate(self, geometry, breakdown=None):
+        """Total reward (per game for a batch). If a breakdown dict is given, each term's weighted values are
+        stored in it."""
+        total = 0.0
+        for name, kernel, weight in self.terms:
+            value = kernel(geometry)
+            if weight != 1:
+                value = weight * value
+            total += value
+            if breakdown is not None:
+                breakdown[name] = value
+        return total
+
+
+### Reward v1 terms
+
+@reward_term('collecting_money')
+def collecting_money(g):
+    """Reward for collecting money, paid while the collection message shows. This should be the highest incentive."""
+    return 50.0 * g.collecting
+
+
+@reward_term('getting_hit')
+def getting_hit(g):
+    """Penalty for getting hit by a bullet, with a larger penalty for the final hit."""
+    return -20.0 * g.hurt - 80.0 * (g.hurt & g.dead)
+
+
+@reward_term('line_of_fire')
+def line_of_fire(g):
+    """Penalty for each bullet above the character in its line of fire, and a lesser one for bullets just past."""
+    above = g.in_line_of_fire & (g.bullet_dy < 0)
+    just_past = g.in_line_of_fire & (g.bullet_dy > 0) & (g.bullet_dy < 100)
+    return -10.0 * g.count(above) - 5.0 * g.count(just_past)
+
+
+@reward_term('upper_half')
+def upper_half(g):
+    """Penalty for staying in the upper half of the screen, which is closer to the source of bullets."""
+    return -5.0 * (g.y < WINDOW_SIZE / 2)
+
+
+@reward_term('loitering_near_edges')
+def loitering_near_edges(g):
+    """Penalty for loitering within 100 pixels of the edges of the screen."""
+    edge = 100
+    near_edge = (g.x < edge) | (g.x > WINDOW_SIZE - edge) | (g.y < edge) | (g.y > WINDOW_SIZE - edge)
+    return -10.0 * near_edge
+
+
+@reward_term('going_too_fast')
+def going_too_fast(g):
+    """Penalty for moving too fast, which might indicate panic or less control."""
+    return -5.0 * (g.speed > MAX_SPEED * 0.8)
+
+
+@reward_term('being_in_center')
+def being_in_center(g):
+    """Small reward for staying near the center of the screen."""
+    return 10 * (1 - g.center_distance / MAX_DISTANCE_FROM_CENTER)
+
+
+@reward_term('dodging_bullets')
+def dodging_bullets(g):
+    """Reward for each bullet in the line of fire that has passed more than 100 pixels below the character."""
+    return 5.0 * g.count(g.in_line_of_fire & (g.bullet_dy > 100))
+
+
+@reward_term('time_since_money_appeared')
+def time_since_money_appeared(g):
+    """Penalty growing with the seconds since the money appeared without being collected."""
+    return -0.1 * g.money_age * g.money_visible
+
+
+@reward_term('proximity_to_money')
+def proximity_to_money(g):
+    """Reward in [0, 20] for being close to the money."""
+    return 20 * (1 - g.money_distance / MAX_DISTANCE)
+
+
+### Reward v2 terms - only for dodging bullets
+
+@reward_term('proximity_to_bullets_v2')
+def proximity_to_bullets_v2(g):
+    """Penalty for every bullet on screen, stronger the closer it is."""
+    return (-50 * (1 - g.bullet_distance / MAX_DISTANCE) * g.bullet_active).sum(axis=-1)
+
+
+@reward_term('getting_hit_by_bullet_v2')
+def getting_hit_by_bullet_v2(g):
+    """Severe penalty for actually getting hit by a bullet."""
+    return -200.0 * g.hurt
+
+
+@reward_term('survival_v2')
+def survival_v2(g):
+    """Reward that grows by 10 points per second survived this episode."""
+    return 10 * g.time
+
+
+REWARD_V1 = RewardEngine([
+    ('collecting_money', 1.0),
+    ('getting_hit', 1.0),
+    ('line_of_fire', 1.0),
+    ('upper_half', 1.0),
+    ('loitering_near_edges', 1.0),
+    ('going_too_fast', 1.0),
+    ('being_in_center', 1.0),
+    ('time_since_money_appeared', 1.0),
+    ('proximity_to_money', 1.0),
+])
+
+REWARD_V2 = RewardEngine([
+    ('proximity_to_bullets_v2', 1.0),
+    ('getting_hit_by_bullet_v2', 1.0),
+    ('survival_v2', 1.0),
+])
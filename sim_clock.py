@@ -0,0 +1,49 @@
+from config import SIM_DT
+
+
+class SimClock:
+    """Fixed-step simulation clock. Game time only moves when advance() is called, so the game plays out
+    identically however fast the host runs it.
+
+    Timed game events (bullet spawns, money respawns, message expiry) are kept as named timers, each due on
+    a whole tick.
+    """
+
+    def __init__(self, dt=SIM_DT):
+        self.dt = dt
+        self.tick = 0
+        self.timers = {}  # timer name -> tick on which it fires
+
+    @property
+    def time(self):
+        """Simulation time in seconds."""
+        return self.tick * self.dt
+
+    def advance(self):
+        """Advance the clock by one tick and return the names of the timers that came due, oldest first."""
+        self.tick += 1
+        fired = [name for name, due in self.timers.items() if due <= self.tick]
+        if fired:
+            fired.sort(key=self.timers.get)
+            for name in fired:
+                del self.timers[name]
+        return fired
+
+    def schedule(self, name, delay):
+        """(Re)arm the named timer to fire `delay` seconds from now - always at least one tick ahead."""
+        self.timers[name] = self.tick + max(1, int(round(delay / self.dt)))
+
+    def cancel(self, name):
+        self.timers.pop(name, None)
+
+    def reset(self):
+        self.tick = 0
+        self.timers.clear()
+
+    def get_state(self):
+        return {'tick': self.tick, 'timers': dict(self.timers)}
+
+    def set_state(self, state):
+        # Timers keep their order - it breaks ties between timers due on the same tick
+        self.tick = state['tick']
+        self.timers = dict(state['timers'])
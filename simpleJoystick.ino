@@ -1,14 +1,41 @@
 const int SW_PIN = 50;
 
+// 0: the original ASCII lines at 9600 baud, every 100 ms - what config.py expects by default
+// 1: fixed-size binary frames at 115200 baud, sampled every 5 ms (set SERIAL_PROTOCOL = 'binary' in config.py)
+#define BINARY_PROTOCOL 0
+
+const byte FRAME_SYNC = 0xA5;
+byte sequence = 0;
+
 void setup() {
+#if BINARY_PROTOCOL
+  Serial.begin(115200);
+#else
   Serial.begin(9600);
+#endif
   digitalWrite(SW_PIN, HIGH);
 }
 
+// Sync byte, x and y (little-endian), switch, sequence number, then the low byte of the sum of those five fields
+void sendFrame(int xValue, int yValue, int switchValue) {
+  byte frame[8] = {FRAME_SYNC, lowByte(xValue), highByte(xValue), lowByte(yValue), highByte(yValue),
+                   (byte)switchValue, sequence++, 0};
+  byte checksum = 0;
+  for (int i = 1; i < 7; i++) {
+    checksum += frame[i];
+  }
+  frame[7] = checksum;
+  Serial.write(frame, sizeof(frame));
+}
+
 void loop() {
   int xValue = analogRead(A7); // Assuming X-axis is connected to A0
   int yValue = analogRead(A6); // Assuming Y-axis is connected to A1
 
+#if BINARY_PROTOCOL
+  sendFrame(xValue, yValue, digitalRead(SW_PIN));
+  delay(5);
+#else
   Serial.print("X:");
   Serial.print(xValue);
   Serial.print(",Y:");
@@ -16,4 +43,5 @@ void loop() {
   Serial.print(",Switch Value:");
   Serial.println(digitalRead(SW_PIN));
   delay(100); // Adjust as needed
-}
\ No newline at end of file
+#endif
+}
@@ -0,0 +1,246 @@
+import numpy as np
+from config import *
+from game_objects import collides, BULLET_WIDTH, BULLET_HEIGHT, MONEY_WIDTH, MONEY_HEIGHT, NO_BULLET
+from input_pipeline import integrate_velocities
+
+MONEY_POINTS = np.array([5, 20, 100])
+NO_TIMER = np.iinfo(np.int64).max
+
+
+def ticks_for(delay):
+    """Whole simulation ticks for a delay in seconds, rounded the same way as SimClock.schedule."""
+    return np.maximum(1, np.rint(delay / SIM_DT)).astype(np.int64)
+
+
+class VecGame:
+    """N independent games stepped in lockstep, stored as NumPy arrays (one row per game).
+
+    Follows the rules of Game.update - movement and clamping, level ups, bullet advance/cull/spawn, money
+    collection and bullet hits - with the timers of SimClock kept as per-game due ticks. Bullets live in
+    preallocated slots per game (BULLET_CAPACITY, doubled when a game's level allows more); spawn order is
+    tracked so hits and observations see bullets oldest first, as BulletManager does. Nothing here draws.
+    """
+
+    def __init__(self, n_games, seed=None, capacity=BULLET_CAPACITY):
+        self.n_games = n_games
+        self.capacity = capacity
+        self.rng = np.random.default_rng(seed)
+
+        # Character
+        self.x = np.zeros(n_games)
+        self.y = np.zeros(n_games)
+        self.velocity_x = np.zeros(n_games)
+        self.velocity_y = np.zeros(n_games)
+        self.health = np.zeros(n_games, dtype=np.int64)
+
+        # Score and level parameters
+        self.score = np.zeros(n_games, dtype=np.int64)
+        self.level = np.ones(n_games, dtype=np.int64)
+        self.bullet_speed = np.full(n_games, BULLET_SPEED, dtype=np.int64)
+        self.max_bullets = np.full(n_games, MAX_BULLETS, dtype=np.int64)
+        self.bullet_interval_min = np.full(n_games, BULLET_INTERVAL_MIN, dtype=np.float64)
+        self.bullet_interval_max = np.full(n_games, BULLET_INTERVAL_MAX, dtype=np.float64)
+        self.next_bullet_interval = self.rng.uniform(BULLET_INTERVAL_MIN, BULLET_INTERVAL_MAX, n_games)
+
+        # Bullet slots
+        self.bullet_x = np.zeros((n_games, capacity))
+        self.bullet_y = np.zeros((n_games, capacity))
+        self.bullet_active = np.zeros((n_games, capacity), dtype=bool)
+        self.bullet_seq = np.zeros((n_games, capacity), dtype=np.int64)
+        self.next_seq = 0
+        self.spawn_due = np.zeros(n_games, dtype=bool)
+
+        # Money
+        self.money_x = np.zeros(n_games, dtype=np.int64)
+        self.money_y = np.zeros(n_games, dtype=np.int64)
+        self.money_visible = np.zeros(n_games, dtype=bool)
+        self.money_appear_tick = np.zeros(n_games, dtype=np.int64)
+        self.respawn_delay = np.zeros(n_games)
+
+        # Messages (the money reward reads whether the collection message is showing)
+        self.collection_message_visible = np.zeros(n_games, dtype=bool)
+        self.level_up_msg_visible = np.zeros(n_games, dtype=bool)
+
+        # Simulation clock and timers, as due ticks (NO_TIMER when not armed)
+        self.tick = np.zeros(n_games, dtype=np.int64)
+        self.spawn_timer = np.full(n_games, NO_TIMER)
+        self.respawn_timer = np.full(n_games, NO_TIMER)
+        self.collection_msg_timer = np.full(n_games, NO_TIMER)
+        self.level_up_msg_timer = np.full(n_games, NO_TIMER)
+
+        # Per-step outcomes
+        self.hit = np.zeros(n_games, dtype=bool)
+        self.collected = np.zeros(n_games, dtype=bool)
+
+        self.reset(np.ones(n_games, dtype=bool))
+
+    @property
+    def time(self):
+        """Simulation time of each game, in seconds since its last reset."""
+        return self.tick * SIM_DT
+
+    def reset(self, mask):
+        """Reset the games selected by a boolean mask, as Game.reset_game does."""
+        n = int(mask.sum())
+        if n == 0:
+            return
+
+        self.x[mask] = INITIAL_X
+        self.y[mask] = INITIAL_Y
+        self.velocity_x[mask] = 0
+        self.velocity_y[mask] = 0
+        self.health[mask] = START_HEALTH
+        self.score[mask] = 0
+        self.level[mask] = 1
+        self.bullet_speed[mask] = BULLET_SPEED
+        self.max_bullets[mask] = MAX_BULLETS
+        self.bullet_interval_min[mask] = BULLET_INTERVAL_MIN
+        self.bullet_interval_max[mask] = BULLET_INTERVAL_MAX
+
+        self.tick[mask] = 0
+        self.collection_message_visible[mask] = False
+        self.level_up_msg_visible[mask] = False
+        self.collection_msg_timer[mask] = NO_TIMER
+        self.level_up_msg_timer[mask] = NO_TIMER
+        self.respawn_timer[mask] = NO_TIMER
+
+        self.bullet_active[mask] = False
+        self.spawn_due[mask] = False
+        self.next_bullet_interval[mask] = self.rng.uniform(BULLET_INTERVAL_MIN, BULLET_INTERVAL_MAX, n)
+        self.spawn_timer[mask] = ticks_for(self.next_bullet_interval[mask])
+
+        self._respawn_money(mask, n)
+
+    def step(self, velocity_x, velocity_y):
+        """Advance every game one tick with the given character velocities."""
+        self.velocity_x = velocity_x
+        self.velocity_y = velocity_y
+        self.tick += 1
+        self._fire_timers()
+
+        # Move the character and keep it within bounds
+        self.x = np.clip(self.x + velocity_x * SENSITIVITY, 0, WINDOW_SIZE - CHARACTER_WIDTH)
+        self.y = np.clip(self.y + velocity_y * SENSITIVITY, 0, WINDOW_SIZE - CHARACTER_HEIGHT)
+
+        self._level_up_bullets()
+        self._update_bullets()
+        self._collect_money()
+        self._check_bullet_collisions()
+
+        return self.health <= 0
+
+    def apply_joystick(self, joystick_x, joystick_y):
+        """Step every game from joystick readings in [0, 1023], integrating velocity as Game.steer does."""
+        return self.step(integrate_velocities(self.velocity_x, joystick_x),
+                         integrate_velocities(self.velocity_y, joystick_y))
+
+    def bullet_order(self, count):
+        """Slot indices of up to `count` bullets per game, oldest first, and whether each one is active."""
+        keys = np.where(self.bullet_active, self.bullet_seq, NO_BULLET)
+        order = np.argsort(keys, axis=1)[:, :count]
+        return order, np.take_along_axis(self.bullet_active, order, axis=1)
+
+    def _fire_timers(self):
+        self.spawn_due |= self.tick >= self.spawn_timer
+        self.spawn_timer[self.spawn_due] = NO_TIMER
+
+        respawn = self.tick >= self.respawn_timer
+        if respawn.any():
+            self.respawn_timer[respawn] = NO_TIMER
+            self._respawn_money(respawn, int(respawn.sum()))
+
+        expired = self.tick >= self.collection_msg_timer
+        self.collection_message_visible[expired] = False
+        self.collection_msg_timer[expired] = NO_TIMER
+
+        expired = self.tick >= self.level_up_msg_timer
+        self.level_up_msg_visible[expired] = False
+        self.level_up_msg_timer[expired] = NO_TIMER
+
+    def _respawn_money(self, mask, n):
+        self.money_x[mask] = self.rng.integers(0, WINDOW_SIZE - MONEY_WIDTH + 1, n)
+        self.money_y[mask] = self.rng.integers(0, WINDOW_SIZE - MONEY_HEIGHT + 1, n)
+        self.money_visible[mask] = True
+        self.money_appear_tick[mask] = self.tick[mask]
+        self.respawn_delay[mask] = self.rng.uniform(RESPAWN_DELAY_MIN, RESPAWN_DELAY_MAX, n)
+
+    def _level_up_bullets(self):
+        level_up = (LEVELER * (self.level + 1) > self.score) & (self.score > LEVELER * self.level)
+        if not level_up.any():
+            return
+
+        odd = self.level % 2 == 1
+        self.max_bullets += level_up & odd
+        self.bullet_speed += level_up & ~odd
+        self.bullet_interval_max -= np.where(level_up & (self.level % 3 == 0), BULLET_INTERVAL_ADJ, 0)
+
+        self.level += level_up
+        self.level_up_msg_visible |= level_up
+        self.level_up_msg_timer[level_up] = self.tick[level_up] + ticks_for(1.0)
+
+    def _update_bullets(self):
+        # Move bullets and cull the ones that left the screen
+        self.bullet_y += self.bullet_speed[:, None]
+        self.bullet_active &= self.bullet_y <= WINDOW_SIZE
+
+        # Spawn once the spawn timer has fired and there is room for another bullet
+        count = self.bullet_active.sum(axis=1)
+        spawn = self.spawn_due & (count < self.max_bullets)
+        games = np.flatnonzero(spawn)
+        if len(games) == 0:
+            return
+        if (count[games] == self.capacity).any():
+            self._grow_bullets()
+        free = ~self.bullet_active
+
+        n = len(games)
+        slots = free[games].argmax(axis=1)
+        self.bullet_x[games, slots] = self.rng.integers(0, WINDOW_SIZE - BULLET_WIDTH + 1, n)
+        self.bullet_y[games, slots] = 0
+        self.bullet_active[games, slots] = True
+        self.bullet_seq[games, slots] = self.next_seq + np.arange(n)
+        self.next_seq += n
+        self.spawn_due[games] = False
+
+        # Same interval swap as BulletManager.update
+        low = self.bullet_interval_min[games]
+        high = self.bullet_interval_max[games]
+        swap = high < low
+        self.bullet_interval_min[games] = np.where(swap, high, low)
+        self.next_bullet_interval[games] = self.rng.uniform(np.where(swap, high, low), np.where(swap, low, high))
+        self.spawn_timer[games] = self.tick[games] + ticks_for(self.next_bullet_interval[games])
+
+    def _grow_bullets(self):
+        # Double every game's bullet slots, as BulletManager.grow does
+        self.capacity *= 2
+        pad = ((0, 0), (0, self.bullet_x.shape[1]))
+        self.bullet_x = np.pad(self.bullet_x, pad)
+        self.bullet_y = np.pad(self.bullet_y, pad)
+        self.bullet_active = np.pad(self.bullet_active, pad)
+        self.bullet_seq = np.pad(self.bullet_seq, pad)
+
+    def _collect_money(self):
+        self.collected = self.money_visible & collides(self.x, self.y, self.money_x, self.money_y,
+                                                       CHARACTER_WIDTH, CHARACTER_HEIGHT)
+        games = np.flatnonzero(self.collected)
+        if len(games) == 0:
+            return
+
+        self.score[games] += self.rng.choice(MONEY_POINTS, len(games))
+        self.money_visible[games] = False
+        self.respawn_timer[games] = self.tick[games] + ticks_for(self.respawn_delay[games])
+        self.collection_message_visible[games] = True
+        self.collection_msg_timer[games] = self.tick[games] + ticks_for(1.0)
+
+    def _check_bullet_collisions(self):
+        hits = self.bullet_active & collides(self.x[:, None], self.y[:, None], self.bullet_x, self.bullet_y,
+                                             BULLET_WIDTH, BULLET_HEIGHT)
+        self.hit = hits.any(axis=1)
+        games = np.flatnonzero(self.hit)
+        if len(games) == 0:
+            return
+
+        # One hit per frame - the oldest bullet that hit is removed
+        slots = np.where(hits[games], self.bullet_seq[games], NO_BULLET).argmin(axis=1)
+        self.bullet_active[games, slots] = False
+        self.health[games] -= BULLET_DAMAGE
@@ -0,0 +1,220 @@
+import inspect
+import time
+import numpy as np
+from gym import spaces
+from stable_baselines3.common.vec_env import VecEnv
+
+from config import *
+from game_env import MyGameEnv
+from vec_game import VecGame
+from reward_engine import StepGeometry, RewardEngine, REWARD_V1, REWARD_V2
+from instrumentation import StepInstrumentation
+
+STEP_PHASES = ('update', 'obs', 'reward')
+
+# Batched equivalents of the MyGameEnv reward functions that can be passed to the trainers
+BATCHED_REWARDS = {
+    MyGameEnv._calculate_reward: REWARD_V1,
+    MyGameEnv._calculate_rewards_v2: REWARD_V2,
+}
+
+
+def batched_reward_engine(reward_function):
+    """The RewardEngine computing a reward function spec for a whole batch - for the default reward, a term
+    list, a RewardEngine or a MyGameEnv reward method in BATCHED_REWARDS - or None if it has none."""
+    if reward_function is None:
+        return REWARD_V1
+    if isinstance(reward_function, (list, tuple)):
+        return RewardEngine(reward_function)
+    if isinstance(reward_function, RewardEngine):
+        return reward_function
+    try:
+        return BATCHED_REWARDS.get(reward_function)
+    except TypeError:  # unhashable
+        return None
+
+
+def is_single_env_reward(reward_function):
+    """Whether a reward function is written for one MyGameEnv - a bound method, or a MyGameEnv method."""
+    return inspect.ismethod(reward_function) or \
+        getattr(MyGameEnv, getattr(reward_function, '__name__', ''), None) is reward_function
+
+
+class MyGameVecEnv(VecEnv):
+    """stable-baselines3 VecEnv over a VecGame - n_envs games stepped together with array operations.
+
+    Observations and actions match MyGameEnv, so models move freely between the two. Finished games are
+    reset automatically, with their final observation in info['terminal_observation']. With instrument=True,
+    phase timings and batch-mean reward terms are summarised in the first env's info every instrument_every
+    steps.
+    """
+
+    def __init__(self, n_envs, reward_function=None, seed=None, instrument=False, instrument_every=1000):
+        self.game = VecGame(n_envs, seed=seed)
+
+        action_space = spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+        self.obs_dim = 4 + 3 * MAX_BULLETS + 3
+        observation_space = spaces.Box(low=-1024, high=1024, shape=(self.obs_dim,), dtype=np.float32)
+        super(MyGameVecEnv, self).__init__(n_envs, observation_space, action_space)
+
+        # Rewards come from a RewardEngine - the MyGameEnv reward methods in BATCHED_REWARDS map to their term
+        # lists - or from a batched function of this env returning one reward per game
+        self.reward_engine = batched_reward_engine(reward_function)
+        self.reward_function = reward_function
+        if self.reward_engine is None and (not callable(reward_function) or is_single_env_reward(reward_function)):
+            raise TypeError(f'{getattr(reward_function, "__qualname__", reward_function)!r} has no batched form - '
+                            f'use a RewardEngine, a list of terms, one of the MyGameEnv rewards in BATCHED_REWARDS '
+                            f'or a function of the MyGameVecEnv')
+
+        self.initial_health = self.game.health.copy()
+        self.actions = np.zeros((n_envs, 2), dtype=np.float32)
+        self.obs = np.zeros((n_envs, self.obs_dim), dtype=np.float32)
+
+        self.instrumentation = StepInstrumentation(STEP_PHASES, report_every=instrument_every) if instrument else None
+
+        # Headless Game drawing render_game() frames, created on first use
+        self.view = None
+        self.render_mode = 'rgb_array'
+
+    def reset(self):
+        self.game.reset(np.ones(self.num_envs, dtype=bool))
+        self.initial_health = self.game.health.copy()
+        return self._get_obs()
+
+    def step_async(self, actions):
+        self.actions = np.asarray(actions, dtype=np.float32).reshape(self.num_envs, 2)
+
+    def step_wait(self):
+        instrumentation = self.instrumentation
+        if instrumentation:
+            t_start = time.perf_counter()
+
+        # Convert actions from [-1, 1] to the joystick range [0, 1023], as input_pipeline.action_to_reading does
+        joystick = ((self.actions + 1) * 511.5).astype(np.int64)
+        dones = self.game.apply_joystick(joystick[:, 0], joystick[:, 1])
+
+        if instrumentation:
+            t_update = time.perf_counter()
+
+        obs = self._get_obs()
+
+        if instrumentation:
+            t_obs = time.perf_counter()
+
+        breakdown = {} if instrumentation else None
+        if self.reward_engine is not None:
+            geometry = StepGeometry.from_vec_game(self.game, self.initial_health)
+            rewards = np.asarray(self.reward_engine.evaluate(geometry, breakdown), dtype=np.float32)
+        else:
+            rewards = np.asarray(self.reward_function(self), dtype=np.float32)
+        self.initial_health = self.game.health.copy()
+        infos = [{} for _ in range(self.num_envs)]
+
+        if instrumentation:
+            instrumentation.record_phases((t_start, t_update, t_obs, time.perf_counter()))
+            instrumentation.record_terms({term: np.mean(values) for term, values in breakdown.items()})
+            summary = instrumentation.end_step()
+            if summary is not None:
+                infos[0]['instrumentation'] = summary
+
+        if dones.any():
+            for i in np.flatnonzero(dones):
+                infos[i]['terminal_observation'] = obs[i].copy()
+                infos[i]['score'] = int(self.game.score[i])
+                infos[i]['level'] = int(self.game.level[i])
+            self.game.reset(dones)
+            self.initial_health = self.game.health.copy()
+            obs = self._get_obs()
+
+        return obs, rewards, dones, infos
+
+    def _get_obs(self):
+        game = self.game
+        obs = self.obs
+
+        obs[:, 0] = game.x
+        obs[:, 1] = game.y
+        obs[:, 2] = game.velocity_x
+        obs[:, 3] = game.velocity_y
+
+        # Oldest MAX_BULLETS bullets as (x, y, speed), zero-padded
+        order, active = game.bullet_order(MAX_BULLETS)
+        bullets = np.zeros((self.num_envs, MAX_BULLETS, 3), dtype=np.float32)
+        bullets[:, :, 0] = np.where(active, np.take_along_axis(game.bullet_x, order, axis=1), 0)
+        bullets[:, :, 1] = np.where(active, np.take_along_axis(game.bullet_y, order, axis=1), 0)
+        bullets[:, :, 2] = np.where(active, game.bullet_speed[:, None], 0)
+        obs[:, 4:4 + 3 * MAX_BULLETS] = bullets.reshape(self.num_envs, -1)
+
+        obs[:, -3] = game.money_x
+        obs[:, -2] = game.money_y
+        obs[:, -1] = game.money_visible
+
+        return obs.copy()
+
+    def close(self):
+        pass
+
+    def seed(self, seed=None):
+        self.game.rng = np.random.default_rng(seed)
+        return [seed] * self.num_envs
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        # There are no per-game env objects - the batch supports the calls made per env: seed (of the generator
+        # every game shares) and render (one game's frame, as get_images() draws them)
+        indices = self._get_indices(indices)
+        if method_name == 'seed':
+            seed = self.seed(*method_args, **method_kwargs)[0]
+            return [seed for _ in indices]
+        if method_name == 'render':
+            return [self.render_game(i, *method_args, **method_kwargs) for i in indices]
+        raise NotImplementedError(f"MyGameVecEnv can't call '{method_name}' per game - only 'seed' and 'render'")
+
+    def get_images(self):
+        # stable-baselines3 1.x doesn't draw frames through env_method, so VecEnv.render('rgb_array') and video
+        # recorders need this
+        return [self.render_game(i) for i in range(self.num_envs)]
+
+    def render_game(self, index, mode='rgb_array'):
+        """Frame of one game of the batch as an (height, width, 3) array, drawn by a headless main.Game set to
+        its state."""
+        if mode != 'rgb_array':
+            raise NotImplementedError(f"MyGameVecEnv only renders 'rgb_array' frames, not '{mode}'")
+        import pygame
+        from main import Game
+
+        if self.view is None:
+            self.view = Game(headless=True)
+        view, game = self.view, self.game
+
+        view.offset_y = game.tick[index] * SCROLL_SPEED % TILE_HEIGHT
+        character = view.character
+        character.x = character.prev_x = game.x[index]
+        character.y = character.prev_y = game.y[index]
+        character.health = int(game.health[index])
+        view.score = int(game.score[index])
+        view.level = int(game.level[index])
+        view.level_up_msg_visible = bool(game.level_up_msg_visible[index])
+        view.collection_message_visible = False  # the batch doesn't keep the amount collected
+
+        bullets = view.bullet_manager
+        bullets.x = game.bullet_x[index].copy()
+        bullets.y = game.bullet_y[index].copy()
+        bullets.active = game.bullet_active[index].copy()
+        bullets.seq = game.bullet_seq[index].copy()
+        bullets.bullet_speed = int(game.bullet_speed[index])
+
+        money = view.money
+        money.x, money.y = int(game.money_x[index]), int(game.money_y[index])
+        money.visible = bool(game.money_visible[index])
+
+        view.render()
+        return pygame.surfarray.array3d(view.screen).swapaxes(0, 1)
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]